@@ -0,0 +1,6 @@
+"""
+Benchmarks to measure the performance of yana.
+
+Run them from the repository's root directory, e.g.
+``python -m benchmarks.startup``.
+"""
@@ -0,0 +1,35 @@
+"""
+Runs yana once with the arguments given and reports how long
+initialization (``Cli()``) and ``Cli.handle_args`` took, as JSON on the
+last line of stderr.
+
+Used by ``benchmarks.run`` to time invocations in fresh processes.
+"""
+
+import sys
+from os.path import dirname, abspath
+from json import dumps
+from time import perf_counter
+
+def main():
+    """
+    Runs yana like ``yana.py`` does and reports timings.
+    """
+    sys.path.insert(0, dirname(dirname(abspath(__file__))))
+    sys.argv[0] = "yana"
+
+    start_time = perf_counter()
+    from lib.cli import Cli
+    cli = Cli()
+    init_time = perf_counter()
+    cli.handle_args()
+    end_time = perf_counter()
+
+    sys.stdout.flush()
+    sys.stderr.write("\n%s\n" % dumps({
+        "init": init_time - start_time,
+        "handle_args": end_time - init_time,
+    }))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Measures memory and throughput of ``Note`` instances for a stream of
+many notes, compared to notes which compute all paths eagerly and keep
+a ``__dict__`` (like ``Note`` used to).
+
+"stream" creates a note per path and prints its path (to nowhere), as
+the list sub command does. "hold" keeps all notes (e.g. to deduplicate
+them) and reports the memory they take.
+"""
+
+from argparse import ArgumentParser
+from gc import collect
+from os import devnull
+from os.path import abspath, relpath, normpath
+from time import perf_counter
+import tracemalloc
+
+from lib.note import Note
+
+
+class EagerNote(object):
+    """
+    A note computing its paths eagerly (for comparison).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        normalized_path = normpath(path)
+        self.relpath = relpath(normalized_path)
+        self.abspath = abspath(normalized_path)
+
+
+def generate_paths(count):
+    """
+    Returns ``count`` paths like a walk of a notes tree would find them.
+    """
+    return ["./dir%u/sub%u/note%u.note" % (i % 97, i % 13, i)
+            for i in range(count)]
+
+
+def stream(note_cls, paths):
+    """
+    Returns how many notes per second are created and printed.
+    """
+    with open(devnull, "w") as output:
+        write = output.write
+        start_time = perf_counter()
+        for path in paths:
+            write("%s\n" % note_cls(path).path)
+        return len(paths) / (perf_counter() - start_time)
+
+
+def hold(note_cls, paths):
+    """
+    Returns how many bytes it takes to keep a note per path and how many
+    notes per second are created (slowed down by tracing allocations).
+    """
+    collect()
+    tracemalloc.start()
+    start_time = perf_counter()
+    notes = [note_cls(path) for path in paths]
+    duration = perf_counter() - start_time
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del notes
+    return size, len(paths) / duration
+
+
+def main():
+    """
+    Runs the benchmark and prints a short report.
+    """
+    arg_parser = ArgumentParser(description=__doc__)
+    arg_parser.add_argument('-n', '--notes', type=int, default=1000000,
+                            help='number of notes')
+    args = arg_parser.parse_args()
+
+    # configure ``Note`` with default options
+    note_arg_parser = ArgumentParser()
+    Note.set_parser(note_arg_parser)
+    Note.set_args(note_arg_parser.parse_args([]))
+
+    paths = generate_paths(args.notes)
+    print("%u notes" % args.notes)
+    for name, note_cls in (("eager (dict)", EagerNote),
+                           ("Note (lazy, slots)", Note)):
+        notes_per_second = stream(note_cls, paths)
+        print("%-20s stream %10.0f notes/s" % (name, notes_per_second))
+        size, notes_per_second = hold(note_cls, paths)
+        print("%-20s hold   %10.0f notes/s %8.1f MiB %6.0f B/note" % (
+            name, notes_per_second, size / 2.0**20, size / len(paths)))
+
+if __name__ == '__main__':
+    main()
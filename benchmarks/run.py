@@ -0,0 +1,168 @@
+"""
+Benchmarks typical invocations of yana on a synthetic tree of notes.
+
+Every invocation runs in a fresh process through ``Cli.handle_args``.
+"cold" runs start with empty caches of yana (note that the operating
+system's caches are not dropped), "warm" runs reuse the caches of
+previous runs.
+
+Results can be stored as JSON and compared to earlier results to catch
+regressions.
+"""
+
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from json import dump, load, loads
+from os import environ
+from os.path import dirname, abspath, join as path_join
+from platform import platform, python_version
+from statistics import median
+from subprocess import run, DEVNULL, PIPE
+from sys import executable, exit as sys_exit
+from tempfile import TemporaryDirectory
+from time import perf_counter, strftime
+
+from benchmarks.tree import add_arguments, generate_tree
+
+INVOKE = path_join(dirname(abspath(__file__)), "invoke.py")
+
+SCENARIOS = (
+    # name, arguments, arguments to run (untimed) before
+    ("list", ["list"], None),
+    ("list -t", ["list", "-t"], None),
+    ("tags -s -n", ["tags", "-s", "-n"], None),
+    ("show", ["show"], None),
+    ("show by index", ["show", "1", "-1", "42"], ["list"]),
+    ("list by pattern", ["list", "*/dir1/*"], ["list"]),
+    ("list by word", ["list", "word:kubernetes"], None),
+)
+
+
+def invoke(arguments, tree_dir, cache_dir):
+    """
+    Runs yana once and returns the timings reported plus the wall time
+    of the whole process.
+    """
+    env = dict(environ, XDG_CACHE_HOME=cache_dir)
+    start_time = perf_counter()
+    process = run([executable, INVOKE] + arguments, cwd=tree_dir, env=env,
+                  stdout=DEVNULL, stderr=PIPE, universal_newlines=True,
+                  check=True)
+    timings = loads(process.stderr.strip().splitlines()[-1])
+    timings["process"] = perf_counter() - start_time
+    return timings
+
+
+def summarize(runs):
+    """
+    Returns minimum and median of all timings of ``runs``.
+    """
+    return dict(
+        (key, {"min": min(r[key] for r in runs),
+               "median": median(r[key] for r in runs)})
+        for key in runs[0]
+    )
+
+
+def benchmark(scenario, tree_dir, runs):
+    """
+    Times the ``scenario`` with cold and warm caches.
+    """
+    _, arguments, setup_arguments = scenario
+
+    cold_runs = []
+    for _ in range(runs):
+        with TemporaryDirectory() as cache_dir:
+            if setup_arguments:
+                invoke(setup_arguments, tree_dir, cache_dir)
+            cold_runs.append(invoke(arguments, tree_dir, cache_dir))
+
+    with TemporaryDirectory() as cache_dir:
+        if setup_arguments:
+            invoke(setup_arguments, tree_dir, cache_dir)
+        invoke(arguments, tree_dir, cache_dir)
+        warm_runs = [invoke(arguments, tree_dir, cache_dir)
+                     for _ in range(runs)]
+
+    return {"cold": summarize(cold_runs), "warm": summarize(warm_runs)}
+
+
+def compare(results, baseline, threshold):
+    """
+    Prints how ``results`` compare to ``baseline`` and returns the number
+    of regressions (i.e. medians slower than ``threshold``).
+    """
+    regressions = 0
+    for name, states in sorted(results.items()):
+        for state, timings in sorted(states.items()):
+            try:
+                old = baseline[name][state]["handle_args"]["median"]
+            except KeyError:
+                continue
+            new = timings["handle_args"]["median"]
+            ratio = new / old if old else float("inf")
+            regressed = ratio > 1 + threshold
+            regressions += regressed
+            print("%-20s %-5s %8.1f ms -> %8.1f ms  (x%.2f)%s" % (
+                name, state, old * 1000, new * 1000, ratio,
+                "  REGRESSION" if regressed else ""))
+    return regressions
+
+
+def main():
+    """
+    Runs the benchmark suite as configured on the command line.
+    """
+    arg_parser = ArgumentParser(description=__doc__,
+                                formatter_class=ArgumentDefaultsHelpFormatter)
+    arg_parser.add_argument('-r', '--runs', type=int, default=3,
+                            help='number of runs per scenario and state')
+    arg_parser.add_argument('-o', '--output',
+                            help='file to store results to (JSON)')
+    arg_parser.add_argument('-c', '--compare',
+                            help='file with results to compare with (JSON)')
+    arg_parser.add_argument('--threshold', type=float, default=0.1,
+                            help='relative slowdown considered a regression')
+    arg_parser.add_argument('-s', '--scenario', action='append',
+                            help='run only this scenario (default: all)')
+    add_arguments(arg_parser)
+    args = arg_parser.parse_args()
+
+    scenarios = [s for s in SCENARIOS
+                 if not args.scenario or s[0] in args.scenario]
+
+    results = {}
+    with TemporaryDirectory() as tree_dir:
+        generate_tree(tree_dir, args)
+        for scenario in scenarios:
+            name = scenario[0]
+            results[name] = benchmark(scenario, tree_dir, args.runs)
+            print("%-20s cold %8.1f ms   warm %8.1f ms" % (
+                name,
+                results[name]["cold"]["handle_args"]["median"] * 1000,
+                results[name]["warm"]["handle_args"]["median"] * 1000))
+
+    tree_args = dict((key, getattr(args, key)) for key in (
+        "notes", "depth", "fan_out", "note_size", "tag_density", "tags",
+        "noise", "seed"))
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            dump({
+                "time": strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": python_version(),
+                "platform": platform(),
+                "runs": args.runs,
+                "tree": tree_args,
+                "results": results,
+            }, output_file, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = load(baseline_file)
+        if baseline.get("tree") != tree_args:
+            print("warning: baseline was measured on a different tree")
+        if compare(results, baseline["results"], args.threshold):
+            sys_exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Measures how long it takes to start yana for typical, trivial
+invocations (compared to starting the bare Python interpreter).
+"""
+
+from argparse import ArgumentParser
+from os import environ
+from os.path import dirname, abspath, join as path_join
+from statistics import median
+from subprocess import call, DEVNULL
+from sys import executable
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+YANA = path_join(dirname(dirname(abspath(__file__))), "yana.py")
+
+INVOCATIONS = (
+    ("python -c pass", [executable, "-c", "pass"]),
+    ("yana --help", [executable, YANA, "--help"]),
+    ("yana edit 3", [executable, YANA, "edit", "--editor", "true", "3"]),
+    ("yana list <empty dir>", [executable, YANA, "list", "."]),
+)
+
+
+def time_invocation(command, runs, env, cwd):
+    """
+    Returns wall times (in seconds) of ``runs`` runs of ``command``.
+    """
+    times = []
+    for _ in range(runs):
+        start_time = perf_counter()
+        call(command, stdout=DEVNULL, stderr=DEVNULL, env=env, cwd=cwd)
+        times.append(perf_counter() - start_time)
+    return times
+
+
+def main():
+    """
+    Runs the startup benchmark and prints a short report.
+    """
+    arg_parser = ArgumentParser(description=__doc__)
+    arg_parser.add_argument('-r', '--runs', type=int, default=20,
+                            help='number of runs per invocation')
+    args = arg_parser.parse_args()
+
+    with TemporaryDirectory() as cache_dir, TemporaryDirectory() as cwd:
+        env = dict(environ, XDG_CACHE_HOME=cache_dir)
+        for name, command in INVOCATIONS:
+            # warm up (e.g. creates the plugin manifest)
+            time_invocation(command, 1, env, cwd)
+            times = time_invocation(command, args.runs, env, cwd)
+            print("%-24s min %7.1f ms   median %7.1f ms" % (
+                name, min(times) * 1000, median(times) * 1000))
+
+if __name__ == '__main__':
+    main()
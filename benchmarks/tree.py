@@ -0,0 +1,115 @@
+"""
+Generates reproducible, synthetic trees of notes to benchmark with.
+"""
+
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from os import makedirs
+from os.path import join as path_join
+from random import Random
+
+WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod "
+    "tempor incididunt ut labore et dolore magna aliqua kubernetes python "
+    "meeting idea todo draft review release backup network storage"
+).split()
+
+NOISE_EXTENSIONS = (".txt", ".py", ".md", ".json", ".log")
+""" extensions of files which are no notes (for the default note regex) """
+
+
+def add_arguments(arg_parser):
+    """
+    Adds arguments to configure the generated tree to ``arg_parser``.
+    """
+    arg_parser.add_argument('--notes', type=int, default=2000,
+                            help='number of notes')
+    arg_parser.add_argument('--depth', type=int, default=3,
+                            help='depth of the directory tree')
+    arg_parser.add_argument('--fan-out', type=int, default=4,
+                            help='sub directories per directory')
+    arg_parser.add_argument('--note-size', type=int, default=2048,
+                            help='average size of notes in bytes')
+    arg_parser.add_argument('--tag-density', type=float, default=2.0,
+                            help='average number of tags per note')
+    arg_parser.add_argument('--tags', type=int, default=200,
+                            help='number of distinct tags')
+    arg_parser.add_argument('--noise', type=float, default=1.0,
+                            help='number of non-note files per note')
+    arg_parser.add_argument('--seed', type=int, default=0,
+                            help='seed for the random number generator')
+
+
+def _dir_paths(root, depth, fan_out):
+    """
+    Returns paths of all directories of the tree (including ``root``).
+    """
+    dir_paths = [root]
+    level = [root]
+    for _ in range(depth):
+        level = [path_join(parent, "dir%u" % index)
+                 for parent in level for index in range(fan_out)]
+        dir_paths.extend(level)
+    return dir_paths
+
+
+def _text(random, size, tags):
+    """
+    Returns a note's contents of about ``size`` bytes with ``tags``
+    spread across it.
+    """
+    words = []
+    length = 0
+    while length < size:
+        word = random.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    for tag in tags:
+        words.insert(random.randrange(len(words) + 1), "#" + tag)
+
+    lines = [" ".join(words[index:index + 12])
+             for index in range(0, len(words), 12)]
+    return "\n".join(lines) + "\n"
+
+
+def generate_tree(root, args):
+    """
+    Generates a tree of notes in ``root`` as configured by ``args``
+    (see ``add_arguments``).
+    The same ``args`` always result in the same tree.
+    """
+    random = Random(args.seed)
+    dir_paths = _dir_paths(root, args.depth, args.fan_out)
+    for dir_path in dir_paths:
+        makedirs(dir_path, exist_ok=True)
+
+    tag_names = ["tag%u" % index for index in range(args.tags)]
+    for index in range(args.notes):
+        dir_path = dir_paths[index % len(dir_paths)]
+        tag_count = int(random.expovariate(1 / args.tag_density)) \
+            if args.tag_density else 0
+        tags = [random.choice(tag_names) for _ in range(tag_count)]
+        size = int(random.expovariate(1 / args.note_size))
+        with open(path_join(dir_path, "note%u.note" % index), "w") as note:
+            note.write(_text(random, size, tags))
+
+    for index in range(int(args.notes * args.noise)):
+        dir_path = random.choice(dir_paths)
+        extension = random.choice(NOISE_EXTENSIONS)
+        with open(path_join(dir_path, "file%u%s" % (index, extension)),
+                  "w") as noise:
+            noise.write(_text(random, args.note_size // 4, ()))
+
+
+def main():
+    """
+    Generates a tree into a directory specified on the command line.
+    """
+    arg_parser = ArgumentParser(description=__doc__,
+                                formatter_class=ArgumentDefaultsHelpFormatter)
+    arg_parser.add_argument('root', help='directory to generate tree into')
+    add_arguments(arg_parser)
+    args = arg_parser.parse_args()
+    generate_tree(args.root, args)
+
+if __name__ == '__main__':
+    main()
@@ -5,13 +5,18 @@ It provides interfaces to the user (i.e. CLI at the moment), glues
 everything together and orchestrates execution.
 """
 
-from os import mkdir
-from os.path import isdir, join as path_join
+from os import makedirs
+from os.path import join as path_join
 
 from appdirs import user_cache_dir
 
 QUEUE_END_SYMBOL = None
 
 CACHE_DIR = path_join(user_cache_dir(), "yana")
-if not isdir(CACHE_DIR):
-    mkdir(CACHE_DIR)
+
+def make_cache_dir():
+    """
+    Creates ``CACHE_DIR`` if it does not exist yet.
+    To be called before writing to it (not earlier to start quickly).
+    """
+    makedirs(CACHE_DIR, exist_ok=True)
@@ -0,0 +1,132 @@
+"""
+Execution backends running the finders (see ``Cli.find_notes``) while
+a sub command consumes the notes found.
+
+"process" forks a process and sends paths through a queue, so walking
+and filtering do not compete with the sub command for the interpreter.
+"thread" runs the finders in a thread feeding a bounded queue and
+"inline" runs the finders one after another in the calling thread, which
+both avoid forking and pickling for queries answered by a few lookups.
+"""
+
+from queue import Queue as ThreadQueue, Empty
+from threading import Thread
+
+from lib.transport import BatchReceiver
+
+
+class ProcessBackend(object):
+    """
+    Runs the finders in a separate process.
+    """
+
+    name = "process"
+
+    def __init__(self):
+        self.process = None
+
+    def start(self, cli, queries):
+        """
+        Starts finding notes for ``queries`` and returns a function to
+        get them one by one (see ``lib.transport.BatchReceiver``).
+        """
+        # (imported here only, since it takes a while and other backends
+        # answer e.g. ``yana show 3`` without it)
+        from multiprocessing import Process, Queue
+        notes_q = Queue(False)
+        self.process = Process(target=cli.find_notes,
+                               args=(queries, notes_q.put))
+        self.process.start()
+        return BatchReceiver(notes_q.get)
+
+    def stop(self):
+        """
+        Stops finding notes early (e.g. on ``KeyboardInterrupt``).
+        """
+        self.process.terminate()
+
+    def join(self):
+        """
+        Waits until finding notes is done.
+        """
+        self.process.join()
+
+
+class ThreadBackend(object):
+    """
+    Runs the finders in a thread of the current process.
+
+    The queue is bounded, so finders do not run far ahead of a slow
+    sub command.
+    """
+
+    name = "thread"
+
+    def __init__(self, max_batches=16):
+        self.notes_q = ThreadQueue(max_batches)
+        self.thread = None
+        self.stopped = False
+
+    def start(self, cli, queries):
+        """
+        Starts finding notes for ``queries`` in a thread and returns a
+        function to get them one by one.
+        """
+        self.thread = Thread(target=cli.find_notes,
+                             args=(queries, self.notes_q.put, False),
+                             name="finders", daemon=True)
+        self.thread.start()
+        return BatchReceiver(self.notes_q.get)
+
+    def stop(self):
+        """
+        Stops waiting for the thread, since threads cannot be terminated
+        (it is a daemon thread, so it just ends with the process).
+        """
+        self.stopped = True
+
+    def join(self):
+        """
+        Waits until finding notes is done (unless stopped).
+        """
+        while not self.stopped and self.thread.is_alive():
+            # drop what the sub command did not take (e.g. since it
+            # failed), so the thread does not block on the full queue
+            try:
+                while True:
+                    self.notes_q.get_nowait()
+            except Empty:
+                pass
+            self.thread.join(0.05)
+
+
+class InlineBackend(object):
+    """
+    Runs the finders whenever the sub command asks for the next note,
+    without any process or queue in between.
+    """
+
+    name = "inline"
+
+    def start(self, cli, queries):
+        """
+        Returns a function to get notes for ``queries`` one by one, which
+        runs the finders one after another in the calling thread as far
+        as needed for the next note.
+        """
+        batches = cli.found_batches(queries, threaded=False)
+        return BatchReceiver(batches.__next__)
+
+    def stop(self):
+        """
+        Nothing to stop, the finders run only when notes are requested.
+        """
+
+    def join(self):
+        """
+        Nothing to wait for (see ``stop``).
+        """
+
+
+BACKENDS = dict((cls.name, cls)
+                for cls in (InlineBackend, ThreadBackend, ProcessBackend))
@@ -0,0 +1,199 @@
+"""
+Persistent caches for information derived from files in the file system.
+
+Cached values are validated by the stat signature of the file they were
+derived from, so files are only read again once they changed.
+"""
+
+from os import getpid, replace, remove
+from os.path import exists, isfile, join as path_join
+from json import dump, load
+from threading import get_ident
+import logging
+
+from lib import CACHE_DIR, make_cache_dir
+
+
+def stat_signature(stat_result):
+    """
+    Returns what we consider to change whenever a file's contents change.
+    """
+    return [stat_result.st_mtime_ns, stat_result.st_size, stat_result.st_ino]
+
+
+class JsonCacheFile(object):
+    """
+    A JSON file in ``CACHE_DIR`` that is written atomically and that is
+    discarded when it was written in a different ``context`` (e.g. with
+    another regular expression configured).
+    """
+
+    def __init__(self, name, context=None):
+        self.file_name = path_join(CACHE_DIR, name)
+        self.context = context
+
+    def load(self):
+        """
+        Returns the cached data or ``None`` if unavailable or invalid.
+        """
+        if not isfile(self.file_name):
+            return None
+        with open(self.file_name, "r") as cache_file:
+            try:
+                data = load(cache_file)
+            except ValueError:
+                remove(self.file_name)
+                return None
+        if not isinstance(data, dict) or data.get("context") != self.context:
+            logging.debug("discarding cache file %s", self.file_name)
+            return None
+        return data.get("data")
+
+    def save(self, data):
+        """
+        Writes ``data`` to a temporary file and renames it to the actual
+        cache file, so concurrent readers never see partial writes.
+        """
+        make_cache_dir()
+        temp_file_name = "%s.%u.%u.tmp" % (self.file_name, getpid(),
+                                           get_ident())
+        with open(temp_file_name, "w") as cache_file:
+            dump({"context": self.context, "data": data}, cache_file)
+        replace(temp_file_name, self.file_name)
+
+
+class StatCache(object):
+    """
+    A persistent mapping from absolute paths to values derived from the
+    files' contents.
+
+    Entries are only considered valid if the stat signature of the file
+    did not change since the value was stored.
+    The file is loaded on first use and only written if it changed.
+    Since several processes may use the cache at the same time, changes
+    are merged into what is on disk when saving.
+    """
+
+    def __init__(self, name, context=None):
+        self.cache_file = JsonCacheFile(name, context)
+        self._entries = None
+        self._changes = {}
+
+    @property
+    def entries(self):
+        """
+        Mapping of paths to ``[signature, value]``, loaded on first access.
+        """
+        if self._entries is None:
+            self._entries = self.cache_file.load() or {}
+            logging.debug("loaded %u entries from %s", len(self._entries),
+                          self.cache_file.file_name)
+        return self._entries
+
+    def get(self, path, stat_result):
+        """
+        Returns the cached value for ``path`` or ``None`` if there is no
+        valid entry.
+        """
+        entry = self.entries.get(path)
+        if entry is None or entry[0] != stat_signature(stat_result):
+            return None
+        return entry[1]
+
+    def set(self, path, stat_result, value):
+        """
+        Stores ``value`` for ``path`` in the state described by
+        ``stat_result``.
+        """
+        entry = [stat_signature(stat_result), value]
+        self.entries[path] = entry
+        self._changes[path] = entry
+
+    def pop_changes(self):
+        """
+        Returns all entries set since the last call and forgets about them.
+
+        Used to transfer entries from other processes which cannot save
+        the cache themselves (see ``merge_changes``).
+        """
+        changes = self._changes
+        self._changes = {}
+        return changes
+
+    def merge_changes(self, changes):
+        """
+        Sets entries returned by ``pop_changes`` of another instance.
+        """
+        self.entries.update(changes)
+        self._changes.update(changes)
+
+    def save(self):
+        """
+        Persists the cache if it was modified.
+
+        Changes are merged into the entries saved meanwhile by other
+        processes (e.g. the finder process and the sub command's process)
+        and entries of files which do not exist anymore are dropped.
+        """
+        if not self._changes:
+            return
+        entries = self.cache_file.load() or {}
+        entries.update(self._changes)
+        entries = dict((path, entry) for path, entry in entries.items()
+                       if exists(path))
+        self.cache_file.save(entries)
+        self._entries = entries
+        self._changes = {}
+
+
+class InvertedStatCache(StatCache):
+    """
+    A ``StatCache`` with lists as values which also knows the paths per
+    item of these lists (e.g. link target -> notes linking to it).
+
+    The inverse mapping is derived from the persisted entries when first
+    needed and kept up to date afterwards. Like the entries, it is not
+    validated, so callers validate hits using ``get``.
+    """
+
+    def __init__(self, name, context=None):
+        super(InvertedStatCache, self).__init__(name, context)
+        self._inverse = None
+
+    @property
+    def inverse(self):
+        """
+        Mapping of items to sets of paths whose values contain them.
+        """
+        if self._inverse is None:
+            inverse = {}
+            for path, (_, values) in self.entries.items():
+                for value in values:
+                    inverse.setdefault(value, set()).add(path)
+            self._inverse = inverse
+        return self._inverse
+
+    def _update_inverse(self, path, entry):
+        if self._inverse is None:
+            return
+        old_entry = self.entries.get(path)
+        if old_entry is not None:
+            for value in old_entry[1]:
+                self._inverse[value].discard(path)
+        for value in entry[1]:
+            self._inverse.setdefault(value, set()).add(path)
+
+    def set(self, path, stat_result, value):
+        self._update_inverse(path, [None, value])
+        super(InvertedStatCache, self).set(path, stat_result, value)
+
+    def merge_changes(self, changes):
+        for path, entry in changes.items():
+            self._update_inverse(path, entry)
+        super(InvertedStatCache, self).merge_changes(changes)
+
+    def save(self):
+        if self._changes:
+            # entries change when saving, so derive it again when needed
+            self._inverse = None
+        super(InvertedStatCache, self).save()
@@ -5,14 +5,33 @@ It contains also the most top-level coordination of the program.
 
 # encoding: UTF-8
 from sys import argv
+from os import stat, cpu_count
+from os.path import abspath
+from collections import deque
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 import logging
-from multiprocessing import Process, Queue
+from queue import Queue as ThreadQueue, Empty
+from threading import Thread
+from time import time
 
-from plugins import Registry
+from plugins import Registry, PluginManifest
 from lib import QUEUE_END_SYMBOL
-from lib.printing import print_default
+from lib.printing import print_default, flush_output
 from lib.note import Note
+from lib.transport import BatchSender
+from lib.backends import BACKENDS
+from lib.profiling import PROFILER
+
+def _is_index(query):
+    """
+    Returns whether ``query`` is an index into the last listing (which
+    may be negative, e.g. ``-1`` for the last note).
+    """
+    try:
+        int(query)
+    except ValueError:
+        return False
+    return True
 
 class Cli(object):
     """
@@ -24,43 +43,79 @@ class Cli(object):
     def __init__(self):
         """
         Finds/loads/initializes everything needed for operation.
+
+        To start quickly, only plugin modules for finders and for the
+        sub command specified on the command line are imported.
         """
 
-        self._init_arg_parser()
-        self._init_logging()
-        self._init_note_class()
-        self._init_and_set_up_finders()
-        self._init_and_set_up_sub_commands()
+        self._enable_profiling_early()
+        self.plugin_manifest = None
+        self._init(None)
         self.args = None
         self.old_cache = None
         self.new_cache = None
 
+    def _init(self, sub_command):
+        """
+        Initializes argument parsing and plugins.
+        If ``sub_command`` is ``None``, it is guessed from ``argv``.
+        """
+        with PROFILER.phase("argument parser setup"):
+            self._init_arg_parser()
+            self._init_logging()
+            self._init_profiling()
+        with PROFILER.phase("plugin import"):
+            if self.plugin_manifest is None:
+                self.plugin_manifest = PluginManifest()
+            if sub_command is None:
+                sub_command = self.plugin_manifest.guess_sub_command(argv[1:])
+            self.plugin_manifest.import_modules(sub_command)
+        with PROFILER.phase("argument parser setup"):
+            self._init_note_class()
+            self._init_and_set_up_finders()
+            self._init_and_set_up_filters()
+            self._init_and_set_up_sub_commands()
+
     def handle_args(self):
         """
         This kicks off the actual operation (i.e. use the users' args,
         options and sub commands to server the request).
         """
-        self._parse_args()
+        with PROFILER.phase("argument parsing"):
+            self._parse_args()
         args = self.args
 
         Note.set_args(args)
 
-        notes_q = Queue(False)
+        sub_command = self.sub_commands[args.subcommand]
 
-        find_process = Process(target=self._find_notes,
-                               args=(args.query, notes_q.put))
-        find_process.start()
+        if sub_command.uses_finders:
+            backend = BACKENDS[self._choose_backend(args.query)]()
+            note_q_get = backend.start(self, args.query)
+        else:
+            backend = None
+
+            def note_q_get():
+                """
+                Signals that no notes are found.
+                """
+                return QUEUE_END_SYMBOL
 
-        sub_command = self.sub_commands[args.subcommand]
         logging.debug("running sub command: '%s'", sub_command.__class__.__name__)
 
         try:
-            sub_command.invoke(args, notes_q.get)
+            with PROFILER.phase("sub command"):
+                sub_command.invoke(args, note_q_get)
         except KeyboardInterrupt:
-            find_process.terminate()
+            if backend is not None:
+                backend.stop()
             print_default("\n")
         finally:
-            find_process.join()
+            flush_output()
+            if backend is not None:
+                backend.join()
+            Note.save_caches()
+            PROFILER.report()
 
     def _init_arg_parser(self):
         self.arg_parser = ArgumentParser(
@@ -69,6 +124,19 @@ class Cli(object):
             epilog="Now you know.",
             formatter_class=ArgumentDefaultsHelpFormatter,
         )
+        self.arg_parser.add_argument('-j', '--jobs', type=int,
+                                     default=cpu_count() or 1,
+                                     help='number of parallel workers')
+        self.arg_parser.add_argument('-u', '--unique', action='store_true',
+                                     default=False, help='pass every note ' +
+                                     'only once, even if found multiple times')
+        self.arg_parser.add_argument('--backend', default='auto',
+                                     choices=['auto'] + sorted(BACKENDS),
+                                     help='where finders run: in a separate ' +
+                                     'process, in a thread or inline when ' +
+                                     'the sub command asks for notes ' +
+                                     '(auto: a process only for queries ' +
+                                     'that walk directories)')
 
     def _parse_args(self):
 
@@ -76,7 +144,15 @@ class Cli(object):
         if len(argv) == 1:
             argv.append("-h")
 
+        # in case we guessed the sub command wrongly (e.g. because it
+        # appeared as value for an option first), start over with it:
+        args, _ = self.arg_parser.parse_known_args()
+        if args.subcommand and args.subcommand not in self.sub_commands:
+            logging.debug("loading sub command '%s' late", args.subcommand)
+            self._init(args.subcommand)
+
         args = self.arg_parser.parse_args()
+
         self.args = args
 
         if args.verbose:
@@ -91,6 +167,28 @@ class Cli(object):
         if '-d' in argv:
             logging.getLogger().setLevel(logging.DEBUG)
 
+    @staticmethod
+    def _enable_profiling_early():
+        """
+        Enables profiling before the arguments are parsed (so we can
+        measure also initialization), if requested.
+        """
+        early_parser = ArgumentParser(add_help=False)
+        early_parser.add_argument('--profile', action='store_true')
+        early_parser.add_argument('--profile-dump')
+        early_args, _ = early_parser.parse_known_args(argv[1:])
+        if early_args.profile or early_args.profile_dump:
+            PROFILER.enable("main", early_args.profile_dump)
+
+    def _init_profiling(self):
+        self.arg_parser.add_argument('--profile', action='store_true',
+                                     default=False, help='print how much ' +
+                                     'time was spent where to stderr')
+        self.arg_parser.add_argument('--profile-dump', metavar='PREFIX',
+                                     help='profile (implies --profile) ' +
+                                     'and dump cProfile statistics per ' +
+                                     'process to PREFIX.<process>.pstats')
+
     def _init_note_class(self):
         Note.set_parser(self.arg_parser)
 
@@ -105,15 +203,21 @@ class Cli(object):
         assert self.finders, "finders must be initialized first"
         finding_help = ', '.join((f.finds for f in self.finders))
 
+        loaded_classes = dict((cls.sub_command, cls)
+                              for cls in Registry.sub_commands)
+
         self.sub_commands = {}
-        for cls in Registry.sub_commands:
-            logging.debug("initializing sub command: %s", cls.__name__)
+        for name, info in sorted(self.plugin_manifest.sub_commands.items()):
+            sub_parser = sub_parsers.add_parser(name, help=info["help"])
 
-            sub_parser = sub_parsers.add_parser(cls.sub_command,
-                                                help=cls.sub_command_help)
-            sub_command = cls()
-            sub_command.set_up(sub_parser)
-            self.sub_commands[cls.sub_command] = sub_command
+            # sub commands which have not been imported only get a parser
+            # to show up in the help
+            cls = loaded_classes.get(name)
+            if cls is not None:
+                logging.debug("initializing sub command: %s", cls.__name__)
+                sub_command = cls()
+                sub_command.set_up(sub_parser)
+                self.sub_commands[name] = sub_command
 
             # add the path argument per default after all other arguments
             sub_parser.add_argument('query', type=str, nargs="*", default=".",
@@ -132,27 +236,204 @@ class Cli(object):
             finder.set_up(self.arg_parser)
             self.finders.append(finder)
 
-    def _find_notes(self, queries, notes_q_put):
+    def _init_and_set_up_filters(self):
+        """
+        Initializes and sets up all filter classes from the
+        corresponding module.
+        """
+        self.filters = []
+        for cls in Registry.filters:
+            logging.debug("initializing and setting up filter: %s", cls.__name__)
+            note_filter = cls()
+            note_filter.set_up(self.arg_parser)
+            self.filters.append(note_filter)
+
+    def _run_finder(self, finder, queries, found_q_put, own_thread=False):
         """
-        Collects paths to notes from finders and submits them as
-        ``Note``s via ``notes_q_put`` to the corresponding sub command.
+        Runs a single finder and puts all paths found via ``found_q_put``,
+        followed by ``QUEUE_END_SYMBOL`` when the finder is done.
+
+        Pass ``own_thread=True`` if the finder runs in a thread started
+        just for it.
         """
+        finder_name = finder.__class__.__name__
+        found_count = [0]
 
         def found_path_callback(path):
             """
-            Initializes ``Note` `from found ``path`` and puts it
-            into the notes queue.
-
-            This function can easily feature deduplication (and actually
-            did) but I am not quite sure if this is actually desired.
+            Counts and forwards a path found by this finder.
             """
-            notes_q_put(Note(path))
+            found_count[0] += 1
+            found_q_put(path)
 
+        if own_thread:
+            PROFILER.profile_thread()
+        logging.debug("running finder: %s", finder_name)
+        start_time = time()
         try:
-            for finder in self.finders:
-                logging.debug("running finder: %s", finder.__class__.__name__)
+            with PROFILER.phase("finder %s" % finder_name, thread=True):
                 finder.find(self.args, queries, found_path_callback)
+        except Exception: #pylint: disable=broad-except
+            logging.exception("finder %s failed", finder_name)
+        finally:
+            logging.debug("finder %s found %u notes in %.3fs", finder_name,
+                          found_count[0], time() - start_time)
+            PROFILER.count("notes found by %s" % finder_name, found_count[0])
+            found_q_put(QUEUE_END_SYMBOL)
+
+    @staticmethod
+    def _new_note_checker():
+        """
+        Returns a function that returns whether a path points to a note
+        which it has not seen yet.
+
+        Notes are identified by device and inode, so we detect duplicates
+        also for different paths to the same note (e.g. links).
+        """
+        seen = set()
+
+        def is_new(path):
+            """
+            Returns ``True`` if the note at ``path`` is seen first.
+            """
+            try:
+                stat_result = stat(path)
+                key = (stat_result.st_dev, stat_result.st_ino)
+            except OSError:
+                # e.g. a new note
+                key = abspath(path)
+            if key in seen:
+                logging.debug("skipping duplicate: %s", path)
+                return False
+            seen.add(key)
+            return True
+
+        return is_new
+
+    def _choose_backend(self, queries):
+        """
+        Returns the name of the backend to run the finders with (see
+        ``lib.backends``).
+
+        Forking pays off only if finders walk directories. Queries for
+        indexes only are answered inline and other queries (e.g. patterns
+        matching the last listing) in a thread.
+        """
+        args = self.args
+        if args.backend != 'auto':
+            return args.backend
+
+        if isinstance(queries, str):
+            queries = [queries]
+        if any(f.walks(args, queries) for f in self.finders):
+            backend = 'process'
+        elif all(_is_index(q) for q in queries):
+            backend = 'inline'
+        else:
+            backend = 'thread'
+        logging.debug("using backend: %s", backend)
+        return backend
+
+    def find_notes(self, queries, notes_q_put, forked=True):
+        """
+        Collects paths to notes from finders and submits them in
+        batches via ``notes_q_put`` to the corresponding sub command
+        (see ``found_batches``).
+
+        Pass ``forked=False`` when running in the process of the sub
+        command, which then saves caches and reports the profile itself.
+        """
+
+        if self.args.profile or self.args.profile_dump:
+            if forked:
+                PROFILER.enable("finder", self.args.profile_dump)
+            else:
+                # e.g. in a thread of the sub command's process
+                PROFILER.profile_thread()
+
+            def timed_notes_q_put(batch, notes_q_put=notes_q_put):
+                """
+                Puts ``batch`` and measures how long that takes.
+                """
+                with PROFILER.phase("queue put"):
+                    notes_q_put(batch)
+
+            notes_q_put = timed_notes_q_put
+
+        try:
+            for batch in self.found_batches(queries):
+                notes_q_put(batch)
         except KeyboardInterrupt:
             pass
 
-        notes_q_put(QUEUE_END_SYMBOL)
+        if forked:
+            # filters may have read tags that are worth keeping
+            Note.save_caches()
+            PROFILER.report()
+
+    def found_batches(self, queries, threaded=True):
+        """
+        Returns a generator of batches of paths to notes found by the
+        finders for ``queries``, ending with ``QUEUE_END_SYMBOL`` (see
+        ``lib.transport``).
+
+        All finders run concurrently (each in its own thread), so results
+        of fast finders are not held back by slow ones.
+        Their results are merged into one stream in order of arrival
+        and, if requested, deduplicated and filtered on the fly.
+
+        If not ``threaded``, the finders run one after another in the
+        calling thread whenever more paths are needed (e.g. for queries
+        answered by a few lookups).
+        """
+
+        if threaded:
+            found_q = ThreadQueue()
+            for finder in self.finders:
+                Thread(target=self._run_finder,
+                       args=(finder, queries, found_q.put, True),
+                       name=finder.__class__.__name__, daemon=True).start()
+            get_found = found_q.get
+        else:
+            found = deque()
+            finders = iter(self.finders)
+
+            def get_found(timeout=None): #pylint: disable=unused-argument
+                """
+                Returns the next path found, running the next finder if
+                the ones run so far found nothing more.
+                """
+                while not found:
+                    self._run_finder(next(finders), queries, found.append)
+                return found.popleft()
+
+        if self.args.unique:
+            is_new = self._new_note_checker()
+        else:
+            is_new = None
+
+        with PROFILER.phase("filter setup"):
+            predicates = [p for p in (f.predicate(self.args)
+                                      for f in self.filters) if p is not None]
+
+        batches = []
+        sender = BatchSender(batches.append)
+        running_finders = len(self.finders)
+        while running_finders:
+            try:
+                path = get_found(timeout=sender.timeout())
+            except Empty:
+                # finders are busy, do not let the sub command wait
+                sender.flush()
+            else:
+                if path is QUEUE_END_SYMBOL:
+                    running_finders -= 1
+                elif ((is_new is None or is_new(path)) and
+                      all(predicate(path) for predicate in predicates)):
+                    sender.send(path)
+            if batches:
+                yield from batches
+                del batches[:]
+
+        sender.close()
+        yield from batches
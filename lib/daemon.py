@@ -0,0 +1,90 @@
+"""
+Client side of the optional yana daemon (see the sub command ``serve``).
+
+Requests and responses are single lines of JSON exchanged over a Unix
+domain socket in ``CACHE_DIR``.
+"""
+
+from json import dumps, loads
+from os.path import join as path_join, exists
+import logging
+import socket
+
+from lib import CACHE_DIR
+
+SOCKET_PATH = path_join(CACHE_DIR, "daemon.sock")
+
+TIMEOUT = 5
+""" seconds to wait for the daemon before giving up """
+
+
+def send_message(sock, message):
+    """
+    Sends ``message`` as line of JSON.
+    """
+    sock.sendall(dumps(message).encode("utf-8") + b"\n")
+
+
+def receive_message(sock):
+    """
+    Receives a line of JSON (or ``None`` if the connection was closed
+    before).
+    """
+    chunks = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        if chunk.endswith(b"\n"):
+            break
+    if not chunks:
+        return None
+    return loads(b"".join(chunks).decode("utf-8"))
+
+
+def request(message):
+    """
+    Sends ``message`` to the daemon and returns its response (or ``None``
+    if there is no daemon running or it failed to respond).
+    """
+    if not exists(SOCKET_PATH):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(TIMEOUT)
+    try:
+        sock.connect(SOCKET_PATH)
+        send_message(sock, message)
+        response = receive_message(sock)
+    except (OSError, ValueError) as exception:
+        logging.debug("no response from daemon: %s", exception)
+        return None
+    finally:
+        sock.close()
+    if response is None or "error" in response:
+        logging.debug("daemon cannot serve %s: %s", message,
+                      response and response["error"])
+        return None
+    return response
+
+
+def find_notes(dir_abspath, note_regex, walk_rules, tag_regex=None,
+               tag_pattern=None):
+    """
+    Returns absolute paths of all notes below ``dir_abspath`` as known to
+    the daemon (or ``None`` if the daemon cannot tell, e.g. since it
+    walks by other rules, see ``WalkRules.context``).
+
+    If ``tag_pattern`` (a regular expression) is given, only notes with
+    a tag it matches are returned, where tags are identified using
+    ``tag_regex``.
+    """
+    response = request({
+        "command": "find",
+        "dir": dir_abspath,
+        "note_regex": note_regex,
+        "walk_rules": walk_rules,
+        "tag_regex": tag_regex,
+        "tag_pattern": tag_pattern,
+    })
+    return None if response is None else response["paths"]
@@ -0,0 +1,90 @@
+"""
+A minimal wrapper around Linux' inotify API (using ``ctypes``, so we do
+not need another dependency).
+"""
+
+from ctypes import CDLL, get_errno
+from ctypes.util import find_library
+from os import read, close, strerror, fsencode, fsdecode
+from struct import calcsize, unpack_from
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT_HEADER = "iIII"
+_EVENT_HEADER_SIZE = calcsize(_EVENT_HEADER)
+
+
+class Inotify(object):
+    """
+    An inotify instance to watch directories with.
+    """
+
+    def __init__(self):
+        self._libc = CDLL(find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(get_errno(), strerror(get_errno()))
+
+    def fileno(self):
+        """
+        Returns the file descriptor (e.g. to wait for events using
+        ``selectors``).
+        """
+        return self.fd
+
+    def add_watch(self, path, mask):
+        """
+        Starts watching ``path`` for events in ``mask`` and returns the
+        watch descriptor.
+        """
+        watch_descriptor = self._libc.inotify_add_watch(self.fd,
+                                                        fsencode(path), mask)
+        if watch_descriptor < 0:
+            raise OSError(get_errno(), strerror(get_errno()), path)
+        return watch_descriptor
+
+    def rm_watch(self, watch_descriptor):
+        """
+        Stops watching for the given watch descriptor.
+        """
+        self._libc.inotify_rm_watch(self.fd, watch_descriptor)
+
+    def read_events(self):
+        """
+        Returns a list of pending events as tuples
+        ``(watch descriptor, mask, cookie, name)``.
+        """
+        try:
+            data = read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            watch_descriptor, mask, cookie, length = unpack_from(
+                _EVENT_HEADER, data, offset)
+            offset += _EVENT_HEADER_SIZE
+            name = fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            events.append((watch_descriptor, mask, cookie, name))
+        return events
+
+    def close(self):
+        """
+        Closes the inotify instance.
+        """
+        close(self.fd)
@@ -2,23 +2,52 @@
 This module implements the in-code representation of on-disk notes.
 """
 
-from os.path import abspath, relpath, normpath, isfile
+from os import stat, sep as pathsep
+from os.path import abspath, relpath, normpath, dirname, join as path_join
 from re import compile as re_compile
+from stat import S_ISREG
 
-# TODO: more laziness for instance variables
-#   https://pypi.python.org/pypi/cached-property
+from lib.cache import StatCache, InvertedStatCache
+from lib.scanning import PatternScanner
+from lib.profiling import PROFILER
+
+_URL_SCHEME = re_compile(r"[a-zA-Z][\w+.-]*:").match
+""" matches link targets which are URLs (e.g. "https://…", "mailto:…") """
 
 class Note(object):
     """
     Programmatic representation ("model") of a note (i.e. a file in the
     file system).
 
-    It provides some helpers for comparing notes and working with tags.
+    It provides some helpers for comparing notes and working with tags
+    and links to other notes.
+
+    Since there may be millions of notes in flight, instances only store
+    the path found and compute everything else on first access.
     """
 
+    __slots__ = ("path", "_normpath", "_relpath", "_abspath", "_tags",
+                 "_links")
+
     _tag_pattern = None
     """ compiled regular expression object """
 
+    _tag_scanner = None
+    """ see ``lib.scanning.PatternScanner`` """
+
+    _tag_cache = None
+    """ persistent cache of tags per note, see ``lib.cache.StatCache`` """
+
+    _link_scanner = None
+    """ see ``lib.scanning.PatternScanner`` """
+
+    _link_cache = None
+    """
+    persistent cache of links per note (and notes linking to a path),
+    i.e. an adjacency index of forward and reverse edges, see
+    ``lib.cache.InvertedStatCache``
+    """
+
     @classmethod
     def set_parser(cls, arg_parser):
         """
@@ -28,6 +57,10 @@ class Note(object):
         arg_parser.add_argument('--tag-regex', help='regular expression ' +
                                 'used to identify tags in notes',
                                 default=r"(?m)(?<!\[)(?:#)([\w_]+)")
+        arg_parser.add_argument('--link-regex', help='regular expression ' +
+                                'used to identify links to other notes ' +
+                                '(its first group is the link target)',
+                                default=r"(?:\]\(|\[\[)([^\s()\[\]|#]+)")
 
     @classmethod
     def set_args(cls, args):
@@ -36,15 +69,145 @@ class Note(object):
         See also method ``set_parser``.
         """
         cls._tag_pattern = re_compile(args.tag_regex)
+        cls._tag_scanner = PatternScanner(cls._tag_pattern)
+        cls._tag_cache = StatCache("tag_cache.json", context=args.tag_regex)
+        cls._link_scanner = PatternScanner(re_compile(args.link_regex))
+        cls._link_cache = InvertedStatCache("link_cache.json",
+                                            context=args.link_regex)
+
+    @classmethod
+    def pop_tag_cache_changes(cls):
+        """
+        Returns what was added to the tag cache in this process, so it can
+        be merged in another process using ``merge_tag_cache_changes``.
+        """
+        return cls._tag_cache.pop_changes()
+
+    @classmethod
+    def merge_tag_cache_changes(cls, changes):
+        """
+        See ``pop_tag_cache_changes``.
+        """
+        cls._tag_cache.merge_changes(changes)
+
+    @classmethod
+    def cached_abspaths_linking_to(cls, target_abspath):
+        """
+        Returns absolute paths of notes which linked to ``target_abspath``
+        when their links were cached.
+        Use ``has_cached_links`` to find out whether that is still valid.
+        """
+        return set(cls._link_cache.inverse.get(target_abspath, ()))
+
+    @classmethod
+    def linked_abspaths(cls, note_abspath):
+        """
+        Returns absolute paths of everything the note at ``note_abspath``
+        links to and of notes linking to it (both read if not cached).
+
+        Notes which linked to it when their links were cached are read
+        again if they changed since, to drop links removed meanwhile.
+        Notes not linked to in the cache are not searched for.
+        """
+        abspaths = set(cls(note_abspath).links)
+        # (reading links updates the inverse mapping)
+        for source_abspath in list(cls._link_cache.inverse.get(note_abspath,
+                                                               ())):
+            source = cls(source_abspath)
+            if source.has_cached_links() or note_abspath in source.links:
+                abspaths.add(source_abspath)
+        return abspaths
+
+    @classmethod
+    def tags_are_line_local(cls):
+        """
+        Returns whether tags never span multiple lines (so notes can be
+        processed line by line).
+        """
+        return cls._tag_scanner.line_local
+
+    @classmethod
+    def replace_tag(cls, text, old_tag, new_tag):
+        """
+        Returns ``text`` with every tag ``old_tag`` replaced by
+        ``new_tag`` and the number of replacements.
+        """
+        tag_group = 1 if cls._tag_pattern.groups else 0
+        count = [0]
+
+        def replace(match):
+            """
+            Replaces the tag within ``match`` if it is ``old_tag``.
+            """
+            if match.group(tag_group) != old_tag:
+                return match.group(0)
+            count[0] += 1
+            start = match.start(tag_group) - match.start()
+            end = match.end(tag_group) - match.start()
+            return match.group(0)[:start] + new_tag + match.group(0)[end:]
+
+        return cls._tag_pattern.sub(replace, text), count[0]
+
+    @classmethod
+    def save_caches(cls):
+        """
+        Persists what was cached during this run.
+        """
+        if cls._tag_cache is not None:
+            cls._tag_cache.save()
+        if cls._link_cache is not None:
+            cls._link_cache.save()
 
     def __init__(self, path):
 
         assert self._tag_pattern is not None
 
         self.path = path
-        normalized_path = normpath(path)
-        self.relpath = relpath(normalized_path)
-        self.abspath = abspath(normalized_path)
+
+    @property
+    def normpath(self):
+        """
+        The path found, normalized.
+        """
+        try:
+            return self._normpath
+        except AttributeError:
+            self._normpath = normpath(self.path)
+            return self._normpath
+
+    @property
+    def relpath(self):
+        """
+        The path relative to the current directory.
+        """
+        try:
+            return self._relpath
+        except AttributeError:
+            self._relpath = relpath(self.normpath)
+            return self._relpath
+
+    @property
+    def mirror_path(self):
+        """
+        The relative path to mirror the note at elsewhere (e.g. in an
+        output directory), keeping the notes' hierarchy: the path relative
+        to the current directory or, for notes outside of it, the absolute
+        path without the leading separator.
+        """
+        if self.relpath.startswith(".." + pathsep):
+            return self.abspath.lstrip(pathsep)
+        return self.relpath
+
+    @property
+    def abspath(self):
+        """
+        The absolute path.
+        """
+        try:
+            return self._abspath
+        except AttributeError:
+            self._abspath = abspath(self.normpath)
+            return self._abspath
 
     def __hash__(self):
         return hash(self.abspath)
@@ -55,14 +218,93 @@ class Note(object):
     def __str__(self):
         return self.path
 
+    def _has_valid_entry(self, cache):
+        try:
+            stat_result = stat(self.abspath)
+        except OSError:
+            return False
+        return cache.get(self.abspath, stat_result) is not None
+
+    def has_cached_tags(self):
+        """
+        Returns whether the cached tags of this note are up to date (i.e.
+        ``tags`` does not need to read the note).
+        """
+        return self._has_valid_entry(self._tag_cache)
+
+    def has_cached_links(self):
+        """
+        Returns whether the cached links of this note are up to date (i.e.
+        ``links`` does not need to read the note).
+        """
+        return self._has_valid_entry(self._link_cache)
+
     @property
     def tags(self):
         """
         Returns all tags that can be found w/i a note.
+
+        Tags are looked up in the tag cache first, so the note is only
+        read if it changed since its tags were cached. They are looked up
+        only once per instance.
         """
-        if not isfile(self.abspath):
+        try:
+            return self._tags
+        except AttributeError:
+            self._tags = self._read_tags()
+            return self._tags
+
+    def _read_tags(self):
+        try:
+            stat_result = stat(self.abspath)
+        except OSError:
+            return set()
+        if not S_ISREG(stat_result.st_mode):
+            return set()
+
+        cached_tags = self._tag_cache.get(self.abspath, stat_result)
+        if cached_tags is not None:
+            PROFILER.count("tags from cache")
+            return set(cached_tags)
+
+        with PROFILER.phase("reading tags"):
+            tags = self._tag_scanner.findall(self.abspath)
+        self._tag_cache.set(self.abspath, stat_result, sorted(tags))
+        return tags
+
+    @property
+    def links(self):
+        """
+        Returns absolute paths of all files linked to w/i a note (e.g.
+        via Markdown or wiki links). URLs and anchors are ignored.
+
+        Like tags, links are looked up in the link cache first (once per
+        instance).
+        """
+        try:
+            return self._links
+        except AttributeError:
+            self._links = self._read_links()
+            return self._links
+
+    def _read_links(self):
+        try:
+            stat_result = stat(self.abspath)
+        except OSError:
+            return []
+        if not S_ISREG(stat_result.st_mode):
             return []
-        with open(self.abspath) as note_file:
-            note_content = note_file.read()
-            tags_list = self._tag_pattern.findall(note_content)
-            return set(tags_list)
+
+        cached_links = self._link_cache.get(self.abspath, stat_result)
+        if cached_links is not None:
+            return cached_links
+
+        with PROFILER.phase("reading links"):
+            targets = self._link_scanner.findall(self.abspath)
+        note_dir = dirname(self.abspath)
+        links = sorted(set(
+            normpath(path_join(note_dir, t)) for t in targets
+            if not _URL_SCHEME(t)
+        ))
+        self._link_cache.set(self.abspath, stat_result, links)
+        return links
@@ -0,0 +1,86 @@
+"""
+Processing of found notes in chunks by a pool of worker processes (e.g.
+for sub commands which read every note).
+"""
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from lib import QUEUE_END_SYMBOL
+from lib.note import Note
+
+CHUNK_SIZE = 256
+""" number of notes a worker processes at once """
+
+
+def map_note_chunks(args, note_q_get, function, *function_args):
+    """
+    Calls ``function(paths, *function_args)`` for chunks of paths of the
+    unique notes received via ``note_q_get`` and yields its results in
+    the order of the chunks.
+
+    ``function`` must be picklable (e.g. defined at module level) and
+    return its result together with its changes to the tag cache (see
+    ``Note.pop_tag_cache_changes``), which are merged here.
+
+    If ``args.jobs`` is greater than one, complete chunks are processed by
+    a pool of worker processes, which starts as soon as the first chunk
+    is complete. Results of workers are yielded once they and all results
+    before are done (checked whenever a chunk is submitted and at the
+    end). Otherwise, ``function`` is called in the calling process as
+    soon as a chunk is complete, as it is for the last incomplete chunk.
+    """
+    seen_notes = set()
+    chunk = []
+    futures = deque()
+    executor = None
+
+    def call(chunk):
+        """
+        Returns the result of ``function`` for ``chunk`` (called here).
+        """
+        result, cache_changes = function(chunk, *function_args)
+        Note.merge_tag_cache_changes(cache_changes)
+        return result
+
+    def result_of(future):
+        """
+        Returns the result of ``function`` for a chunk (called by a
+        worker).
+        """
+        result, cache_changes = future.result()
+        Note.merge_tag_cache_changes(cache_changes)
+        return result
+
+    try:
+        for note in iter(note_q_get, QUEUE_END_SYMBOL):
+            if note in seen_notes:
+                continue
+            seen_notes.add(note)
+            chunk.append(note.path)
+            if len(chunk) < CHUNK_SIZE:
+                continue
+
+            if executor is None and args.jobs > 1:
+                executor = ProcessPoolExecutor(max_workers=args.jobs,
+                                               initializer=Note.set_args,
+                                               initargs=(args,))
+            if executor is None:
+                yield call(chunk)
+            else:
+                futures.append(executor.submit(function, chunk,
+                                               *function_args))
+                while futures and futures[0].done():
+                    yield result_of(futures.popleft())
+            chunk = []
+
+        # (while workers are still busy)
+        last_result = call(chunk) if chunk else None
+        while futures:
+            yield result_of(futures.popleft())
+        if chunk:
+            yield last_result
+
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
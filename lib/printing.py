@@ -4,8 +4,9 @@ A few helpers to have a unified printing facility (similar to logging).
 
 import sys
 from os import linesep
+from time import monotonic
 
-from blessings import Terminal
+from lib.profiling import PROFILER
 
 PYTHON_MAJOR_VERSION = sys.version_info[0]
 
@@ -14,7 +15,113 @@ if PYTHON_MAJOR_VERSION == 2:
     reload(sys)
     sys.setdefaultencoding('utf8')
 
-TERMINAL = Terminal()
+_TERMINAL = None
+
+def get_terminal():
+    """
+    Returns the terminal to write styled output to.
+
+    It is created on first use only, since this takes a while and is only
+    needed when writing to a TTY.
+    """
+    global _TERMINAL #pylint: disable=global-statement
+    if _TERMINAL is None:
+        from blessings import Terminal
+        _TERMINAL = Terminal()
+    return _TERMINAL
+
+_STYLE_SEQUENCES = {}
+""" style -> (escape sequence to start style, escape sequence to reset) """
+
+def _style_sequences(style):
+    """
+    Returns the escape sequences for ``style`` (looked up once per style).
+    """
+    sequences = _STYLE_SEQUENCES.get(style)
+    if sequences is None:
+        terminal = get_terminal()
+        sequences = (getattr(terminal, style), terminal.normal)
+        _STYLE_SEQUENCES[style] = sequences
+    return sequences
+
+
+class OutputBuffer(object):
+    """
+    Buffers output to non-interactive streams (e.g. pipes or files) to
+    save system calls. Output to TTYs is written immediately.
+
+    Buffered output is flushed when it reaches ``max_size`` characters,
+    when the last flush was more than ``max_delay`` seconds ago or when
+    ``flush`` is called explicitly (e.g. after a batch of notes).
+    Writes to different non-interactive streams are flushed in the order
+    they were made (e.g. if stdout and stderr are redirected to the same
+    file), regardless of writes to TTYs in between.
+    """
+
+    def __init__(self, max_size=65536, max_delay=0.1):
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self._segments = []
+        """ list of [stream, list of texts] in order of writing """
+        self._size = 0
+        self._last_flush_time = monotonic()
+        self._isatty = {}
+
+    def isatty(self, stream):
+        """
+        Returns (and remembers) whether ``stream`` is a TTY.
+        """
+        isatty = self._isatty.get(stream)
+        if isatty is None:
+            isatty = self._isatty[stream] = stream.isatty()
+        return isatty
+
+    def write(self, stream, text):
+        """
+        Writes ``text`` to ``stream`` (or buffers it).
+        """
+        if self.isatty(stream):
+            # output buffered for other streams is not flushed, since it
+            # goes elsewhere (e.g. ``yana list | less`` from a terminal)
+            stream.write(text)
+            stream.flush()
+            return
+
+        segments = self._segments
+        if segments and segments[-1][0] is stream:
+            segments[-1][1].append(text)
+        else:
+            segments.append([stream, [text]])
+        self._size += len(text)
+
+        if (self._size >= self.max_size or
+                monotonic() - self._last_flush_time >= self.max_delay):
+            self.flush()
+
+    def flush(self):
+        """
+        Writes all buffered output.
+        """
+        self._last_flush_time = monotonic()
+        if not self._segments:
+            return
+        streams = set()
+        for stream, texts in self._segments:
+            stream.write("".join(texts))
+            streams.add(stream)
+        for stream in streams:
+            stream.flush()
+        self._segments = []
+        self._size = 0
+
+OUTPUT_BUFFER = OutputBuffer()
+
+def flush_output():
+    """
+    Writes all buffered output (see ``OutputBuffer``).
+    To be called e.g. before writing to ``sys.stdout`` directly.
+    """
+    OUTPUT_BUFFER.flush()
 
 def styled_print(style, text, interactive_only=False):
     """
@@ -22,30 +129,26 @@ def styled_print(style, text, interactive_only=False):
 
     If ``interactive_only``, ``text`` is printed to ``stderr``, so that
     e.g. programs connected via a pipe do not see it.
-    """
-    stream = sys.stderr if interactive_only else sys.stdout
-    if stream.isatty():
 
-        # excluding newlines from styling since resetting right after a
-        # newline seems not to work
-        if text.endswith(linesep):
-            text = text[:-len(linesep)]
-            append = linesep
-        else:
-            append = ""
+    Output is styled and written immediately only for TTYs, otherwise it
+    is buffered (see ``OutputBuffer``).
+    """
+    with PROFILER.phase("output"):
+        stream = sys.stderr if interactive_only else sys.stdout
+        if OUTPUT_BUFFER.isatty(stream):
 
-        text = "".join((
-            getattr(TERMINAL, style),
-            text,
-            TERMINAL.normal,
-            append
-        ))
+            # excluding newlines from styling since resetting right after a
+            # newline seems not to work
+            if text.endswith(linesep):
+                text = text[:-len(linesep)]
+                append = linesep
+            else:
+                append = ""
 
-    stream.write(text)
+            start_sequence, reset_sequence = _style_sequences(style)
+            text = "".join((start_sequence, text, reset_sequence, append))
 
-    # make unbuffered writes in Python 3
-    if PYTHON_MAJOR_VERSION == 3:
-        stream.flush()
+        OUTPUT_BUFFER.write(stream, text)
 
 def print_default(text, interactive_only=False):
     """
@@ -0,0 +1,173 @@
+"""
+Lightweight instrumentation to find out where time is spent.
+
+Code wraps phases of interest in ``with PROFILER.phase("…"):``, which
+costs next to nothing unless profiling was enabled (see ``--profile``).
+Every process reports its own summary to stderr.
+"""
+
+import sys
+from threading import Lock
+from time import perf_counter, process_time, thread_time
+
+
+class _NullPhase(object):
+    """
+    Context manager that does nothing (used if profiling is disabled).
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        return False
+
+_NULL_PHASE = _NullPhase()
+
+
+class _Phase(object):
+    """
+    Context manager that measures wall and CPU time of a phase.
+    """
+
+    def __init__(self, profiler, name, cpu_clock):
+        self.profiler = profiler
+        self.name = name
+        self.cpu_clock = cpu_clock
+        self.wall_start = self.cpu_start = None
+
+    def __enter__(self):
+        self.wall_start = perf_counter()
+        self.cpu_start = self.cpu_clock()
+        return self
+
+    def __exit__(self, *_):
+        self.profiler.add(self.name, perf_counter() - self.wall_start,
+                          self.cpu_clock() - self.cpu_start)
+        return False
+
+
+class Profiler(object):
+    """
+    Accumulates wall and CPU times of phases as well as counters per
+    process and optionally runs ``cProfile``.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.role = None
+        self.dump_prefix = None
+        self._profile = None
+        self._thread_profiles = []
+        self._lock = Lock()
+        self.phases = {}
+        """ name -> [calls, wall time, CPU time] """
+        self.counters = {}
+
+    def enable(self, role, dump_prefix=None):
+        """
+        Starts profiling for the current process, which is described by
+        ``role`` (e.g. "main"). Profiling data of a parent process
+        (e.g. before forking) is discarded.
+
+        If ``dump_prefix`` is given, ``cProfile`` runs as well and its
+        statistics are dumped to "<dump_prefix>.<role>.pstats".
+        """
+        if self._profile is not None:
+            # e.g. inherited from the parent process
+            self._profile.disable()
+            self._profile = None
+        self.enabled = True
+        self.role = role
+        self.dump_prefix = dump_prefix
+        self.phases = {}
+        self.counters = {}
+        self._thread_profiles = []
+        if dump_prefix:
+            from cProfile import Profile
+            self._profile = Profile()
+            self._profile.enable()
+
+    def profile_thread(self):
+        """
+        Runs ``cProfile`` for the calling thread as well (if enabled),
+        since a profile records only the thread it was enabled in.
+
+        To be called first in threads started while profiling (e.g. as
+        ``initializer`` of thread pools). Statistics of all threads are
+        merged when reporting.
+        """
+        if self._profile is None:
+            return
+        from cProfile import Profile
+        profile = Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python >= 3.12: only one profile can be active, but it
+            # records all threads already
+            return
+        with self._lock:
+            self._thread_profiles.append(profile)
+
+    def phase(self, name, thread=False):
+        """
+        Returns a context manager that measures the phase ``name``.
+
+        Pass ``thread=True`` to measure the CPU time of the current
+        thread only (instead of the whole process).
+        """
+        if not self.enabled:
+            return _NULL_PHASE
+        return _Phase(self, name, thread_time if thread else process_time)
+
+    def add(self, name, wall_time, cpu_time=0.0):
+        """
+        Adds a measurement of the phase ``name``.
+        """
+        with self._lock:
+            phase = self.phases.setdefault(name, [0, 0.0, 0.0])
+            phase[0] += 1
+            phase[1] += wall_time
+            phase[2] += cpu_time
+
+    def count(self, name, increment=1):
+        """
+        Increments the counter ``name``.
+        """
+        if self.enabled:
+            with self._lock:
+                self.counters[name] = self.counters.get(name, 0) + increment
+
+    def report(self):
+        """
+        Prints a summary to stderr and dumps ``cProfile`` statistics if
+        requested.
+        """
+        if not self.enabled:
+            return
+
+        if self._profile is not None:
+            from pstats import Stats
+            self._profile.disable()
+            stats = Stats(self._profile)
+            with self._lock:
+                for profile in self._thread_profiles:
+                    stats.add(profile)
+            file_name = "%s.%s.pstats" % (self.dump_prefix, self.role)
+            stats.dump_stats(file_name)
+
+        lines = ["", "profile of %s process:" % self.role,
+                 "  %-44s %8s %10s %10s" % ("phase", "calls", "wall [s]",
+                                            "cpu [s]")]
+        for name, (calls, wall_time, cpu_time) in self.phases.items():
+            lines.append("  %-44s %8u %10.4f %10.4f" % (name, calls,
+                                                       wall_time, cpu_time))
+        for name, value in self.counters.items():
+            lines.append("  %-44s %8u" % (name, value))
+        if self._profile is not None:
+            lines.append("  cProfile statistics: %s" % file_name)
+        sys.stderr.write("\n".join(lines) + "\n")
+        sys.stderr.flush()
+
+PROFILER = Profiler()
@@ -0,0 +1,223 @@
+r"""
+Scanning of files for matches of regular expressions without reading
+whole files into memory.
+
+Files are memory-mapped and skipped quickly if they do not contain a
+literal every match must contain (derived from the regular expression,
+one per branch for alternations like ``\]\(|\[\[``).
+For regular expressions which cannot match across lines, only lines
+containing such a literal are decoded and searched.
+"""
+
+from mmap import mmap, ACCESS_READ
+from re import IGNORECASE, MULTILINE, DOTALL
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:
+    import sre_parse, sre_constants #pylint: disable=deprecated-module
+
+ENCODING = "utf-8"
+
+NEWLINE = ord("\n")
+
+_NEWLINE_CATEGORIES = (
+    sre_constants.CATEGORY_SPACE,
+    sre_constants.CATEGORY_NOT_WORD,
+    sre_constants.CATEGORY_NOT_DIGIT,
+)
+""" categories of characters which include the newline character """
+
+
+def _literals_key(literals):
+    """
+    Returns how selective it is to search for ``literals`` (the larger
+    the better): long literals first, then as few as possible.
+    """
+    return min(len(l) for l in literals), -len(literals)
+
+
+def _required_literals(sub_pattern):
+    """
+    Returns strings of which every match of ``sub_pattern`` must contain
+    at least one (or an empty tuple if we cannot tell).
+    """
+    best = ()
+    current = ""
+    for op, av in sub_pattern:
+        candidate = ()
+        if op is sre_constants.LITERAL:
+            current += chr(av)
+            candidate = (current,)
+        else:
+            current = ""
+            if op is sre_constants.SUBPATTERN:
+                _, add_flags, _, group_pattern = av
+                if not add_flags & IGNORECASE:
+                    candidate = _required_literals(group_pattern)
+            elif op is sre_constants.BRANCH:
+                branch_literals = [_required_literals(p) for p in av[1]]
+                if all(branch_literals):
+                    candidate = tuple(sorted(set(
+                        l for literals in branch_literals for l in literals)))
+        if candidate and (not best or
+                          _literals_key(candidate) > _literals_key(best)):
+            best = candidate
+    return best
+
+
+def _in_matches_newline(items):
+    """
+    Returns whether a character set (``IN``) can match a newline.
+    """
+    negated = False
+    matches = False
+    for op, av in items:
+        if op is sre_constants.NEGATE:
+            negated = True
+        elif op is sre_constants.LITERAL:
+            matches = matches or av == NEWLINE
+        elif op is sre_constants.RANGE:
+            matches = matches or av[0] <= NEWLINE <= av[1]
+        elif op is sre_constants.CATEGORY:
+            matches = matches or av in _NEWLINE_CATEGORIES
+        else:
+            # to be on the safe side
+            return True
+    return matches != negated
+
+
+def _is_line_local(sub_pattern, flags):
+    """
+    Returns whether matches of ``sub_pattern`` can be found by searching
+    every line separately (i.e. no match can span or depend on multiple
+    lines).
+    """
+    for op, av in sub_pattern:
+        if op is sre_constants.LITERAL:
+            if av == NEWLINE:
+                return False
+        elif op is sre_constants.ANY:
+            if flags & DOTALL:
+                return False
+        elif op is sre_constants.IN:
+            if _in_matches_newline(av):
+                return False
+        elif op is sre_constants.AT:
+            if av in (sre_constants.AT_BEGINNING, sre_constants.AT_END):
+                if not flags & MULTILINE:
+                    return False
+            elif av not in (sre_constants.AT_BOUNDARY,
+                            sre_constants.AT_NON_BOUNDARY):
+                return False
+        elif op is sre_constants.SUBPATTERN:
+            _, add_flags, del_flags, group_pattern = av
+            if not _is_line_local(group_pattern,
+                                  (flags | add_flags) & ~del_flags):
+                return False
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT,
+                    getattr(sre_constants, "POSSESSIVE_REPEAT", None)):
+            if not _is_line_local(av[2], flags):
+                return False
+        elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            if not _is_line_local(av[1], flags):
+                return False
+        elif op is sre_constants.BRANCH:
+            if not all(_is_line_local(p, flags) for p in av[1]):
+                return False
+        elif op is getattr(sre_constants, "ATOMIC_GROUP", None):
+            if not _is_line_local(av, flags):
+                return False
+        else:
+            # e.g. NOT_LITERAL or group references
+            return False
+    return True
+
+
+def file_contains(path, literal):
+    """
+    Returns whether the file at ``path`` contains the bytes ``literal``.
+    """
+    return file_contains_any(path, (literal,))
+
+
+def file_contains_any(path, literals):
+    """
+    Returns whether the file at ``path`` contains any of the bytes
+    ``literals``.
+    """
+    with open(path, "rb") as file_obj:
+        try:
+            with mmap(file_obj.fileno(), 0, access=ACCESS_READ) as data:
+                return any(data.find(l) >= 0 for l in literals)
+        except ValueError:
+            # empty files cannot be mapped
+            return not all(literals)
+
+
+class PatternScanner(object):
+    """
+    Finds all matches of a compiled regular expression in files.
+    """
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        sub_pattern = sre_parse.parse(pattern.pattern, pattern.flags)
+
+        if pattern.flags & IGNORECASE:
+            literals = ()
+        else:
+            literals = _required_literals(sub_pattern)
+        self.literals = tuple(l.encode(ENCODING) for l in literals)
+        """ bytes of which every match contains some (empty if unknown) """
+
+        self.line_local = bool(literals) and _is_line_local(sub_pattern,
+                                                            pattern.flags)
+        """ whether it suffices to search lines containing ``literals`` """
+
+    def file_contains_literal(self, path):
+        """
+        Returns whether the file at ``path`` contains any of
+        ``self.literals``, i.e. if it is worth to search it for matches.
+        """
+        return not self.literals or file_contains_any(path, self.literals)
+
+    def findall(self, path):
+        """
+        Returns a set of all matches in the file at ``path`` (like
+        ``re.findall``, i.e. groups if the pattern has any).
+        """
+        with open(path, "rb") as file_obj:
+            try:
+                data = mmap(file_obj.fileno(), 0, access=ACCESS_READ)
+            except ValueError:
+                # empty files cannot be mapped
+                return set(self.pattern.findall(""))
+            with data:
+                return self._findall_in(data)
+
+    def _findall_in(self, data):
+        literals = self.literals
+        findall = self.pattern.findall
+        if literals and all(data.find(l) < 0 for l in literals):
+            return set()
+        if not self.line_local:
+            return set(findall(data[:].decode(ENCODING, "replace")))
+
+        # lines (by their start) containing any literal
+        lines = {}
+        for literal in literals:
+            position = data.find(literal)
+            while position >= 0:
+                line_start = data.rfind(b"\n", 0, position) + 1
+                line_end = data.find(b"\n", position)
+                if line_end < 0:
+                    line_end = len(data)
+                lines[line_start] = line_end
+                position = data.find(literal, line_end)
+
+        matches = set()
+        for line_start, line_end in lines.items():
+            line = data[line_start:line_end].decode(ENCODING, "replace")
+            matches.update(findall(line))
+        return matches
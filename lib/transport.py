@@ -0,0 +1,100 @@
+"""
+Transport of found notes from finders to sub commands.
+
+Paths are sent in batches to save per-item (un-)pickling and locking
+when sending them through a queue between processes.
+``Note``s are initialized on the receiving side.
+"""
+
+from time import time
+
+from lib import QUEUE_END_SYMBOL
+from lib.note import Note
+from lib.profiling import PROFILER
+from lib.printing import flush_output
+
+
+class BatchSender(object):
+    """
+    Collects paths and puts them as lists via ``q_put``.
+
+    A batch is sent as soon as it holds ``max_size`` paths or as soon as
+    its first path waited for ``max_delay`` seconds (see ``timeout``).
+    """
+
+    def __init__(self, q_put, max_size=1024, max_delay=0.05):
+        self.q_put = q_put
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self._batch = []
+        self._batch_start_time = None
+
+    def send(self, path):
+        """
+        Adds ``path`` to the current batch and sends the batch if due.
+        """
+        batch = self._batch
+        if not batch:
+            self._batch_start_time = time()
+        batch.append(path)
+        if (len(batch) >= self.max_size or
+                time() - self._batch_start_time >= self.max_delay):
+            self.flush()
+
+    def timeout(self):
+        """
+        Returns how many seconds the current batch may still wait before
+        it must be sent (``None`` if there is nothing to send).
+
+        Useful as timeout when waiting for further paths to send.
+        """
+        if not self._batch:
+            return None
+        return max(0, self._batch_start_time + self.max_delay - time())
+
+    def flush(self):
+        """
+        Sends the current batch (if any).
+        """
+        if self._batch:
+            self.q_put(self._batch)
+            self._batch = []
+
+    def close(self):
+        """
+        Sends the current batch (if any) and signals the end of the stream.
+        """
+        self.flush()
+        self.q_put(QUEUE_END_SYMBOL)
+
+
+class BatchReceiver(object):
+    """
+    Receives batches of paths via ``q_get`` and returns one ``Note`` per
+    call (or ``QUEUE_END_SYMBOL`` at the end of the stream).
+
+    Thus, instances can be passed to sub commands as ``note_q_get``.
+    """
+
+    def __init__(self, q_get):
+        self.q_get = q_get
+        self._batch = iter(())
+        self._ended = False
+
+    def __call__(self):
+        for path in self._batch:
+            return Note(path)
+        while not self._ended:
+
+            # show what we have got so far before we (possibly) wait
+            flush_output()
+
+            with PROFILER.phase("queue wait"):
+                batch = self.q_get()
+            if batch is QUEUE_END_SYMBOL:
+                self._ended = True
+                break
+            self._batch = iter(batch)
+            for path in self._batch:
+                return Note(path)
+        return QUEUE_END_SYMBOL
@@ -18,13 +18,18 @@ to call all plugins on all extension points.
 Also the shared state within one respective object of such a class might
 turn out to be an illusion when different kinds of plugins are distributed
 across processes. This would probably be confusion to program.
+
+Plugin modules are not imported until needed (see ``PluginManifest``),
+because importing all of them slows down every single invocation.
 """
 
 import abc
-from pkgutil import walk_packages
+from importlib import import_module
+from os import scandir
 import logging
 
 from lib import QUEUE_END_SYMBOL
+from lib.cache import JsonCacheFile
 
 
 class Registry(object):
@@ -37,6 +42,7 @@ class Registry(object):
 
     sub_commands = set()
     finders = set()
+    filters = set()
 
     def __init__(self):
         """
@@ -64,6 +70,13 @@ class Registry(object):
         """
         return cls._register(cls.finders, plugin_cls)
 
+    @classmethod
+    def register_filter(cls, plugin_cls):
+        """
+        Registers a filter class.
+        """
+        return cls._register(cls.filters, plugin_cls)
+
 
 class AbstractBasePlugin(object):
     """
@@ -96,6 +109,13 @@ class AbstractBaseSubCommand(AbstractBasePlugin):
     Short description of sub command.
     """
 
+    uses_finders = True
+    """
+    Whether notes are found for the sub command (i.e. whether
+    ``invoke(…)`` receives any). Sub commands handling the queries
+    themselves set this to ``False``.
+    """
+
     def __init__(self, *args, **kwargs):
 
         assert self.sub_command is not None
@@ -144,6 +164,15 @@ class AbstractBaseFinder(AbstractBasePlugin):
         """
         pass
 
+    def walks(self, args, queries):
+        """
+        Returns whether finding notes for ``queries`` takes more than a
+        few lookups (e.g. walking a directory tree).
+        Used to pick the execution backend, so finders which do not know
+        better are assumed to walk.
+        """
+        return True
+
     @abc.abstractproperty
     def finds(self):
         """
@@ -153,7 +182,123 @@ class AbstractBaseFinder(AbstractBasePlugin):
         """
         pass
 
-# load sub modules so they can register at the corresponding registry
-for module_finder, module_name, _ in walk_packages(__path__):
+
+class AbstractBaseFilter(AbstractBasePlugin):
+    """
+    All filters should from this base class.
+
+    Filters run in the same process as finders and decide which of the
+    paths found are passed on to the sub command.
+    """
+
+    __metaclass__ = abc.ABCMeta
+
+    @abc.abstractmethod
+    def predicate(self, args):
+        """
+        Returns a function that returns whether to pass on a path found
+        or ``None`` if the user did not ask for this filter.
+        Called once per run, so expensive preparations go here.
+        """
+        pass
+
+
+class PluginManifest(object):
+    """
+    Knows which plugin module provides which plugins, without importing
+    plugin modules.
+
+    Therefore, the manifest is cached in ``CACHE_DIR``. When any plugin
+    module changed, all plugin modules are imported once to recreate the
+    manifest.
+    """
+
+    def __init__(self):
+        cache_file = JsonCacheFile("plugin_manifest.json",
+                                   context=self._modules_signature())
+        data = cache_file.load()
+        if data is None:
+            data = self._create()
+            cache_file.save(data)
+
+        self.sub_commands = data["sub_commands"]
+        """ sub command -> ``{"module": …, "help": …}`` """
+
+        self.finder_modules = data["finder_modules"]
+        """ names of modules that provide finders """
+
+        self.filter_modules = data["filter_modules"]
+        """ names of modules that provide filters """
+
+    @staticmethod
+    def _modules_signature():
+        """
+        Returns what we consider to change whenever plugins change.
+        """
+        signature = []
+        for dir_entry in scandir(__path__[0]):
+            if dir_entry.name.endswith(".py"):
+                stat_result = dir_entry.stat()
+                signature.append([dir_entry.name, stat_result.st_mtime_ns,
+                                  stat_result.st_size])
+        return sorted(signature)
+
+    @staticmethod
+    def _create():
+        """
+        Imports all plugin modules and returns what they provide.
+        """
+        logging.debug("creating plugin manifest")
+        from pkgutil import walk_packages
+        for _, module_name, _ in walk_packages(__path__, __name__ + "."):
+            import_plugin_module(module_name)
+
+        return {
+            "sub_commands": dict(
+                (cls.sub_command, {"module": cls.__module__,
+                                   "help": cls.sub_command_help})
+                for cls in Registry.sub_commands
+            ),
+            "finder_modules": sorted(set(
+                cls.__module__ for cls in Registry.finders
+            )),
+            "filter_modules": sorted(set(
+                cls.__module__ for cls in Registry.filters
+            )),
+        }
+
+    def guess_sub_command(self, arguments):
+        """
+        Returns the first of ``arguments`` that is a known sub command
+        (or ``None``).
+
+        This allows to import only the module of the sub command to run
+        before the arguments are actually parsed.
+        """
+        for argument in arguments:
+            if argument in self.sub_commands:
+                return argument
+        return None
+
+    def import_modules(self, sub_command=None):
+        """
+        Imports modules for all finders and filters and for
+        ``sub_command`` (if any), so they can register.
+        """
+        # (careful: ``list`` is shadowed by our sub module of that name)
+        module_names = self.finder_modules + self.filter_modules
+        if sub_command in self.sub_commands:
+            module_names.append(self.sub_commands[sub_command]["module"])
+        for module_name in module_names:
+            import_plugin_module(module_name)
+
+
+def import_plugin_module(module_name):
+    """
+    Imports a plugin module so it can register at the ``Registry``.
+
+    (importing modules by their full name ensures every module is loaded
+    only once, even if plugin modules import each other)
+    """
     logging.debug("loading plugin module %s", module_name)
-    module_finder.find_spec(f".{module_name}").loader.load_module()
+    import_module(module_name)
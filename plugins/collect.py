@@ -0,0 +1,261 @@
+"""
+Implements a plugin to collect notes into a directory or a tar archive
+(e.g. for archiving).
+"""
+
+import logging
+import sys
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+from os import sep as pathsep, stat, link, replace, remove, makedirs, \
+    getpid
+from os.path import join as path_join, dirname, basename, abspath, \
+    samefile
+from shutil import copyfileobj, copystat
+from tempfile import mkstemp
+from threading import get_ident
+
+try:
+    from fcntl import ioctl
+except ImportError:
+    ioctl = None
+
+try:
+    from os import copy_file_range
+except ImportError:
+    copy_file_range = None
+
+from plugins import Registry, AbstractBaseSubCommand
+
+from lib import QUEUE_END_SYMBOL
+from lib.printing import print_default
+
+FICLONE = 0x40049409
+""" ioctl request to share all blocks of a file (aka reflink) """
+
+COPY_CHUNK_SIZE = 1 << 30
+
+
+def _clone(source_fd, target_fd):
+    """
+    Tries to make ``target_fd`` share the blocks of ``source_fd`` and
+    returns whether that worked.
+    """
+    if ioctl is None:
+        return False
+    try:
+        ioctl(target_fd, FICLONE, source_fd)
+    except OSError:
+        # e.g. not supported by the file system or different ones
+        return False
+    return True
+
+
+def _copy_file_range(source_fd, target_fd):
+    """
+    Tries to copy ``source_fd`` to ``target_fd`` within the kernel and
+    returns whether that worked.
+    """
+    if copy_file_range is None:
+        return False
+    copied = 0
+    while True:
+        try:
+            count = copy_file_range(source_fd, target_fd, COPY_CHUNK_SIZE)
+        except OSError:
+            if copied == 0:
+                return False
+            raise
+        if count == 0:
+            return True
+        copied += count
+
+
+def copy_note(source_path, target_path):
+    """
+    Copies ``source_path`` to ``target_path`` atomically (via a temporary
+    file), preferring a reflink, then a copy within the kernel, and keeps
+    the modification time (see ``is_unchanged``).
+    """
+    temp_fd, temp_path = mkstemp(dir=dirname(target_path),
+                                 prefix=".%s." % basename(target_path),
+                                 suffix=".tmp")
+    try:
+        with open(source_path, "rb") as source_file, \
+                open(temp_fd, "wb") as temp_file:
+            source_fd = source_file.fileno()
+            if not (_clone(source_fd, temp_fd) or
+                    _copy_file_range(source_fd, temp_fd)):
+                copyfileobj(source_file, temp_file)
+        copystat(source_path, temp_path)
+        replace(temp_path, target_path)
+    except BaseException:
+        remove(temp_path)
+        raise
+
+
+def link_note(source_path, target_path):
+    """
+    Hard links ``source_path`` to ``target_path`` (replacing it).
+    """
+    temp_path = "%s.%u.%u.tmp" % (target_path, getpid(), get_ident())
+    link(source_path, temp_path)
+    replace(temp_path, target_path)
+
+
+def is_unchanged(source_path, target_path):
+    """
+    Returns whether ``target_path`` seems to be a copy of the current
+    state of ``source_path`` already (by size and modification time).
+    """
+    try:
+        target_stat = stat(target_path)
+    except OSError:
+        return False
+    source_stat = stat(source_path)
+    return (source_stat.st_size == target_stat.st_size and
+            source_stat.st_mtime_ns == target_stat.st_mtime_ns)
+
+
+@Registry.register_sub_command
+class CollectSubCommand(AbstractBaseSubCommand):
+    """
+    A sub command that collects notes into a directory, either keeping
+    their hierarchy or flat, or into a tar archive.
+
+    Notes are copied in parallel, using reflinks or copies within the
+    kernel if possible, or hard linked. Notes whose copies have the same
+    size and modification time already are skipped, so collecting
+    repeatedly only copies what changed.
+    """
+
+    sub_command = "collect"
+    sub_command_help = "collect notes into a directory or tar archive"
+
+    def set_up(self, arg_parser):
+        arg_parser.add_argument('-f', '--flat', action='store_true',
+                                default=False, help='do not keep the ' +
+                                'hierarchy (directories become part of ' +
+                                'file names)')
+        arg_parser.add_argument('-l', '--link', action='store_true',
+                                default=False, help='hard link instead ' +
+                                'of copying if possible')
+        arg_parser.add_argument('--tar', action='store_true', default=False,
+                                help='write a tar archive to TARGET (- ' +
+                                'for stdout, compressed by extension)')
+        arg_parser.add_argument('target', help='directory (or tar ' +
+                                'archive) to collect notes in')
+
+    @staticmethod
+    def target_name(note, flat):
+        """
+        Returns the path of ``note`` within the target directory.
+        """
+        name = note.mirror_path
+        if flat:
+            name = name.replace(pathsep, "_")
+        return name
+
+    def _notes_to_collect(self, args, note_q_get):
+        """
+        Yields ``(note, target name)`` once per target name for notes not
+        within the target already.
+        """
+        target_prefix = abspath(args.target) + pathsep
+        sources = {}
+        for note in iter(note_q_get, QUEUE_END_SYMBOL):
+            if note.abspath.startswith(target_prefix):
+                continue
+            name = self.target_name(note, args.flat)
+            if name in sources:
+                if sources[name] != note.abspath:
+                    logging.warning("not collecting %s, since %s is " +
+                                    "collected as %s already", note.path,
+                                    sources[name], name)
+                continue
+            sources[name] = note.abspath
+            yield note, name
+
+    def invoke(self, args, note_q_get):
+        notes = self._notes_to_collect(args, note_q_get)
+        if args.tar:
+            self.write_tar(args, notes)
+        else:
+            self.collect_into_directory(args, notes)
+
+    @staticmethod
+    def _collect_note(args, source_path, target_path):
+        """
+        Collects a single note and returns what was done.
+        """
+        makedirs(dirname(target_path), exist_ok=True)
+        if args.link:
+            try:
+                if samefile(source_path, target_path):
+                    return "unchanged"
+            except OSError:
+                pass
+            try:
+                link_note(source_path, target_path)
+                return "linked"
+            except OSError as exception:
+                logging.info("cannot link %s (%s), copying instead",
+                             source_path, exception)
+        if is_unchanged(source_path, target_path):
+            return "unchanged"
+        copy_note(source_path, target_path)
+        return "copied"
+
+    def collect_into_directory(self, args, notes):
+        """
+        Copies (or links) ``notes`` into the target directory using a pool
+        of ``args.jobs`` threads (which mostly wait for system calls).
+        """
+        counts = {"copied": 0, "linked": 0, "unchanged": 0, "failed": 0}
+        with ThreadPoolExecutor(max_workers=max(args.jobs, 1)) as executor:
+            futures = []
+            for note, name in notes:
+                target_path = path_join(args.target, name)
+                futures.append((note, executor.submit(
+                    self._collect_note, args, note.path, target_path)))
+            for note, future in futures:
+                try:
+                    result = future.result()
+                except OSError as exception:
+                    logging.error("cannot collect %s: %s", note.path,
+                                  exception)
+                    result = "failed"
+                logging.info("%s: %s", result, note.path)
+                counts[result] += 1
+
+        print_default("%(copied)u copied, %(linked)u linked, "
+                      "%(unchanged)u unchanged, %(failed)u failed\n" % counts,
+                      interactive_only=True)
+
+    @staticmethod
+    def write_tar(args, notes):
+        """
+        Streams ``notes`` into a tar archive (without seeking, so it can
+        be written to a pipe).
+        """
+        compression = ""
+        for extension in ("gz", "bz2", "xz"):
+            if args.target.endswith("." + extension):
+                compression = extension
+        mode = "w|%s" % compression
+
+        if args.target == "-":
+            archive = tarfile.open(fileobj=sys.stdout.buffer, mode=mode)
+        else:
+            archive = tarfile.open(args.target, mode=mode)
+        count = 0
+        with archive:
+            for note, name in notes:
+                try:
+                    archive.add(note.path, arcname=name, recursive=False)
+                except OSError as exception:
+                    logging.error("cannot collect %s: %s", note.path,
+                                  exception)
+                    continue
+                count += 1
+        print_default("%u notes archived\n" % count, interactive_only=True)
@@ -0,0 +1,206 @@
+"""
+Implements a plugin to compile notes (e.g. to HTML) using an external
+markup compiler.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+from os import sep as pathsep, stat, makedirs, remove
+from os.path import join as path_join, dirname, splitext, abspath, exists
+from shlex import split as split_command
+from subprocess import run, PIPE, DEVNULL
+
+from plugins import Registry, AbstractBaseSubCommand
+
+from lib import QUEUE_END_SYMBOL
+from lib.cache import JsonCacheFile, stat_signature
+from lib.printing import print_default
+
+
+def file_hash(path):
+    """
+    Returns the hash of the contents of the file at ``path``.
+    """
+    digest = sha256()
+    with open(path, "rb") as file_obj:
+        for block in iter(lambda: file_obj.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class BuildManifest(object):
+    """
+    Remembers which state of which note was compiled to which output, so
+    only notes which changed since are compiled again.
+
+    It is stored in ``CACHE_DIR`` and discarded if the compiler, the
+    output directory or the extension change.
+    """
+
+    def __init__(self, context):
+        self.cache_file = JsonCacheFile("compile_manifest.json", context)
+        self.entries = self.cache_file.load() or {}
+        """ source path -> ``[stat signature, hash, output path]`` """
+        self.changed = False
+
+    def is_up_to_date(self, source_path, output_path):
+        """
+        Returns whether ``output_path`` was compiled from the current
+        contents of ``source_path``.
+
+        If only the stat signature of the source changed (e.g. since it
+        was touched), its contents are hashed to find out.
+        """
+        entry = self.entries.get(source_path)
+        if entry is None or entry[2] != output_path or not exists(output_path):
+            return False
+        try:
+            signature = stat_signature(stat(source_path))
+            if entry[0] == signature:
+                return True
+            if entry[1] != file_hash(source_path):
+                return False
+        except OSError:
+            return False
+        entry[0] = signature
+        self.changed = True
+        return True
+
+    def set(self, source_path, output_path, signature, source_hash):
+        """
+        Records that ``output_path`` was compiled from ``source_path`` in
+        the state described by ``signature`` and ``source_hash``.
+        """
+        self.entries[source_path] = [signature, source_hash, output_path]
+        self.changed = True
+
+    def save(self):
+        """
+        Persists the manifest if it changed.
+        """
+        if self.changed:
+            self.cache_file.save(self.entries)
+            self.changed = False
+
+
+@Registry.register_sub_command
+class CompileSubCommand(AbstractBaseSubCommand):
+    """
+    A sub command that compiles notes using an external compiler.
+
+    Notes are compiled in parallel by ``--jobs`` compiler processes.
+    Notes which did not change since they were compiled last time (see
+    ``BuildManifest``) are not compiled again. Notes which would be
+    compiled to the output of another note are skipped and notes within
+    the output directory are ignored.
+    """
+
+    sub_command = "compile"
+    sub_command_help = "compile notes using a markup compiler"
+
+    def set_up(self, arg_parser):
+        arg_parser.add_argument('-c', '--compiler',
+                                default="pandoc -s -o {output} {input}",
+                                help='command to compile a note, where ' +
+                                '{input} and {output} are replaced by the ' +
+                                'paths (without {output}, the output is ' +
+                                'read from stdout)')
+        arg_parser.add_argument('-o', '--output-dir', default="compiled",
+                                help='directory to write outputs to ' +
+                                '(keeping the notes\' hierarchy)')
+        arg_parser.add_argument('-e', '--extension', default="html",
+                                help='file extension of outputs')
+        arg_parser.add_argument('-f', '--force', action='store_true',
+                                default=False, help='compile notes even ' +
+                                'if they did not change')
+
+    @staticmethod
+    def output_path(args, note):
+        """
+        Returns the path to compile ``note`` to.
+        """
+        return abspath(path_join(args.output_dir, "%s.%s" % (
+            splitext(note.mirror_path)[0], args.extension)))
+
+    @staticmethod
+    def compile_note(args, source_path, output_path):
+        """
+        Compiles a single note and returns the stat signature and hash of
+        the source as it was compiled.
+        """
+        signature = stat_signature(stat(source_path))
+        source_hash = file_hash(source_path)
+        makedirs(dirname(output_path), exist_ok=True)
+
+        # other braces (e.g. in awk snippets) are no placeholders
+        template = split_command(args.compiler)
+        command = [a.replace("{input}", source_path)
+                   .replace("{output}", output_path) for a in template]
+        logging.debug("executing '%s'", " ".join(command))
+        if any("{output}" in a for a in template):
+            result = run(command, stdin=DEVNULL, stderr=PIPE, check=False)
+        else:
+            with open(output_path, "wb") as output_file:
+                result = run(command, stdin=DEVNULL, stdout=output_file,
+                             stderr=PIPE, check=False)
+        if result.returncode != 0:
+            if exists(output_path):
+                remove(output_path)
+            raise RuntimeError(result.stderr.decode("utf-8", "replace")
+                               .strip() or "exit code %d" % result.returncode)
+        return signature, source_hash
+
+    def invoke(self, args, note_q_get):
+        manifest = BuildManifest([args.compiler, abspath(args.output_dir),
+                                  args.extension])
+        output_prefix = abspath(args.output_dir) + pathsep
+        compiled = unchanged = failed = skipped = 0
+        # output path -> absolute path of the note compiled to it
+        sources = {}
+
+        try:
+            with ThreadPoolExecutor(max_workers=max(args.jobs, 1)) as executor:
+                futures = []
+                for note in iter(note_q_get, QUEUE_END_SYMBOL):
+                    # (e.g. outputs of former runs matching the note regex)
+                    if note.abspath.startswith(output_prefix):
+                        logging.debug("not compiling %s within the output " +
+                                      "directory", note.path)
+                        continue
+                    output_path = self.output_path(args, note)
+                    # e.g. "a.note" and "a.notes" (or a note found twice)
+                    if output_path in sources:
+                        if sources[output_path] != note.abspath:
+                            logging.warning("not compiling %s, since %s " +
+                                            "is compiled to %s already",
+                                            note.path, sources[output_path],
+                                            output_path)
+                            skipped += 1
+                        continue
+                    sources[output_path] = note.abspath
+                    if (not args.force and
+                            manifest.is_up_to_date(note.abspath, output_path)):
+                        unchanged += 1
+                        continue
+                    futures.append((note, output_path, executor.submit(
+                        self.compile_note, args, note.abspath, output_path)))
+
+                for note, output_path, future in futures:
+                    try:
+                        signature, source_hash = future.result()
+                    except Exception as exception: #pylint: disable=broad-except
+                        logging.error("cannot compile %s: %s", note.path,
+                                      exception)
+                        failed += 1
+                        continue
+                    manifest.set(note.abspath, output_path, signature,
+                                 source_hash)
+                    print_default("%s\n" % output_path)
+                    compiled += 1
+        finally:
+            manifest.save()
+
+        summary = "%u compiled, %u unchanged, %u failed, %u skipped\n"
+        print_default(summary % (compiled, unchanged, failed, skipped),
+                      interactive_only=True)
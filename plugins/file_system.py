@@ -4,12 +4,513 @@ Implements plugins to find notes in the file system.
 
 
 import re
-from os import walk
-from os.path import isfile, isdir, join as path_join
+from fnmatch import translate
+from os import scandir, stat, sep as pathsep
+from os.path import isfile, isdir, realpath, abspath, join as path_join
+from collections import deque
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor
+from time import time
 import logging
 
+from lib import daemon
+from lib.cache import JsonCacheFile
+from lib.profiling import PROFILER
 from plugins import Registry, AbstractBaseFinder
 
+
+class DirSnapshots(object):
+    """
+    Persisted snapshots of directories: their mtime, the names of notes
+    and of sub directories within and whether they contain an ignore
+    file (see ``WalkRules``).
+
+    Since a directory's mtime changes whenever entries are added,
+    removed or renamed, unchanged directories can be answered from their
+    snapshots without listing them again. Snapshots are discarded if
+    the regular expression to identify notes or the name of ignore files
+    changed. Snapshots are taken before applying ``WalkRules``, so they
+    stay valid if other rules change.
+    """
+
+    RACY_SECONDS = 2
+    """
+    Directories modified more recently than this are not snapshotted,
+    since further changes within the mtime's granularity would go
+    unnoticed.
+    """
+
+    def __init__(self, note_regex, ignore_file):
+        self.cache_file = JsonCacheFile("dir_snapshots.json",
+                                        context=[note_regex, ignore_file])
+        self.snapshots = self.cache_file.load() or {}
+        """
+        absolute path -> [mtime, names of notes, names of sub dirs,
+        whether there is an ignore file]
+        """
+        self.visited = set()
+        self.dirty = False
+
+    def get(self, dir_abspath, mtime_ns):
+        """
+        Returns the snapshot for the directory if still valid, else
+        ``None``.
+        """
+        snapshot = self.snapshots.get(dir_abspath)
+        if snapshot is None or snapshot[0] != mtime_ns:
+            return None
+        return snapshot
+
+    def update(self, dir_abspath, snapshot):
+        """
+        Remembers that ``dir_abspath`` was visited and its new
+        ``snapshot`` (if any).
+        """
+        self.visited.add(dir_abspath)
+        if snapshot is not None:
+            self.snapshots[dir_abspath] = snapshot
+            self.dirty = True
+
+    def save(self, walked_dir_paths):
+        """
+        Drops snapshots of no longer existing directories below
+        ``walked_dir_paths`` and persists the snapshots if they changed.
+        """
+        prefixes = tuple(abspath(p).rstrip(pathsep) + pathsep
+                         for p in walked_dir_paths)
+        for dir_abspath in list(self.snapshots):
+            if (dir_abspath.startswith(prefixes) and
+                    dir_abspath not in self.visited):
+                del self.snapshots[dir_abspath]
+                self.dirty = True
+        if self.dirty:
+            self.cache_file.save(self.snapshots)
+            self.dirty = False
+
+
+DEFAULT_EXCLUDES = (".git", ".hg", ".svn", ".bzr", "node_modules",
+                    "__pycache__", ".tox", ".venv", "venv", ".mypy_cache",
+                    ".pytest_cache")
+""" names of directories never containing notes (usually) """
+
+
+def _translate_ignore_pattern(line):
+    """
+    Translates a line of an ignore file (gitignore-style) to
+    ``(match function, negated, directories only)`` or ``None`` if the
+    line contains no pattern.
+
+    Patterns are matched against paths relative to the directory of the
+    ignore file, using "/" as separator.
+    """
+    line = line.rstrip()
+    if not line or line.startswith("#"):
+        return None
+    negated = line.startswith("!")
+    if negated:
+        line = line[1:]
+    dir_only = line.endswith("/")
+    line = line.rstrip("/")
+    # patterns containing a slash are relative to the ignore file
+    anchored = "/" in line
+    line = line.lstrip("/")
+    if not line:
+        return None
+
+    parts = []
+    position = 0
+    while position < len(line):
+        if line.startswith("**/", position):
+            parts.append("(?:.*/)?")
+            position += 3
+        elif line.startswith("**", position):
+            parts.append(".*")
+            position += 2
+        elif line[position] == "*":
+            parts.append("[^/]*")
+            position += 1
+        elif line[position] == "?":
+            parts.append("[^/]")
+            position += 1
+        elif line[position] == "[" and "]" in line[position + 2:]:
+            end = line.index("]", position + 2)
+            char_class = line[position + 1:end]
+            if char_class.startswith("!"):
+                char_class = "^" + char_class[1:]
+            parts.append("[%s]" % char_class)
+            position = end + 1
+        else:
+            if line[position] == "\\" and position + 1 < len(line):
+                position += 1
+            parts.append(re.escape(line[position]))
+            position += 1
+
+    prefix = "" if anchored else "(?:.*/)?"
+    return (re.compile("%s%s$" % (prefix, "".join(parts))).match, negated,
+            dir_only)
+
+
+def read_ignore_file(path):
+    """
+    Returns the patterns of the ignore file at ``path`` (see
+    ``_translate_ignore_pattern``).
+    """
+    try:
+        with open(path, "r") as ignore_file:
+            patterns = [_translate_ignore_pattern(l) for l in ignore_file]
+    except (OSError, UnicodeError) as exception:
+        logging.info("cannot read ignore file %s: %s", path, exception)
+        return []
+    return [p for p in patterns if p is not None]
+
+
+def _is_ignored(ignores, name, is_dir):
+    """
+    Returns whether ``name`` is ignored according to ``ignores`` (see
+    ``WalkRules.apply``). Like for git, the last matching pattern wins.
+    """
+    ignored = False
+    for prefix, patterns in ignores:
+        relative_path = prefix + name
+        for match, negated, dir_only in patterns:
+            if (not dir_only or is_dir) and match(relative_path):
+                ignored = not negated
+    return ignored
+
+
+class WalkRules(object):
+    """
+    Decides which directories to descend into and which notes to pass
+    on while walking, so that pruned sub trees are never listed.
+
+    Rules consist of ignore files (gitignore-style, applying to the
+    directory they are in and everything below), excluded names (shell
+    patterns), hidden directories, a maximum depth and whether to stay on
+    the file system of the walked directory.
+
+    Walking a directory requires a state: ``(depth, device, ignores)``,
+    where ``ignores`` are tuples of ``(path prefix, patterns)`` of the
+    ignore files of the directories above.
+    """
+
+    def __init__(self, ignore_file=".yanaignore", excludes=DEFAULT_EXCLUDES,
+                 hidden=False, max_depth=None, one_file_system=False):
+        self.ignore_file = ignore_file
+        self.excludes = list(excludes)
+        self.is_excluded = (re.compile("|".join(
+            translate(p) for p in excludes)).match if excludes else None)
+        self.hidden = hidden
+        self.max_depth = max_depth
+        self.one_file_system = one_file_system
+
+    @classmethod
+    def from_args(cls, args):
+        """
+        Returns the rules configured by the user.
+        """
+        excludes = list(args.exclude or [])
+        if args.default_excludes:
+            excludes.extend(DEFAULT_EXCLUDES)
+        return cls(args.ignore_file, excludes, args.hidden, args.max_depth,
+                   args.one_file_system)
+
+    def context(self):
+        """
+        Returns what the rules consist of (e.g. to find out whether a
+        daemon walks by the same rules).
+        """
+        return [self.ignore_file, sorted(self.excludes), self.hidden,
+                self.max_depth, self.one_file_system]
+
+    def root_state(self, dir_path):
+        """
+        Returns the state to walk ``dir_path`` with as topmost directory.
+        """
+        device = None
+        if self.one_file_system:
+            try:
+                device = stat(dir_path).st_dev
+            except OSError:
+                pass
+        return (0, device, ())
+
+    def is_root_like(self, dir_path, state):
+        """
+        Returns whether walking ``dir_path`` with ``state`` passes on the
+        same notes as walking it as topmost directory.
+        """
+        if state is None:
+            return False
+        depth, device, ignores = state
+        return (not ignores and device == self.root_state(dir_path)[1] and
+                (self.max_depth is None or depth == 0))
+
+    def state_below(self, root, dir_path):
+        """
+        Returns the state walking ``root`` reaches ``dir_path`` (within
+        ``root``) with or ``None`` if ``dir_path`` is pruned on the way.
+        """
+        state = self.root_state(root)
+        current_path = root
+        for name in dir_path[len(root):].split(pathsep):
+            if not name:
+                continue
+            has_ignore_file = bool(self.ignore_file) and isfile(
+                path_join(current_path, self.ignore_file))
+            _, sub_dirs = self.apply(current_path, state, [], [name],
+                                     has_ignore_file)
+            if not sub_dirs:
+                return None
+            state = sub_dirs[0][1]
+            current_path = path_join(current_path, name)
+        return state
+
+    def apply(self, dir_path, state, note_names, sub_dir_names,
+              has_ignore_file):
+        """
+        Returns the names of notes to pass on and ``(name, state)`` of sub
+        directories to descend into.
+        """
+        depth, device, ignores = state
+        if has_ignore_file and self.ignore_file:
+            patterns = read_ignore_file(path_join(dir_path,
+                                                  self.ignore_file))
+            if patterns:
+                ignores = ignores + (("", patterns),)
+
+        is_excluded = self.is_excluded
+        kept_note_names = [
+            n for n in note_names
+            if not (is_excluded and is_excluded(n) or
+                    _is_ignored(ignores, n, False))
+        ]
+
+        if self.max_depth is not None and depth >= self.max_depth:
+            return kept_note_names, []
+        kept_sub_dirs = []
+        for name in sub_dir_names:
+            if (not self.hidden and name.startswith(".") or
+                    is_excluded and is_excluded(name) or
+                    _is_ignored(ignores, name, True)):
+                logging.debug("not descending into %s",
+                              path_join(dir_path, name))
+                continue
+            if device is not None:
+                try:
+                    if stat(path_join(dir_path, name)).st_dev != device:
+                        logging.debug("not crossing file system boundary " +
+                                      "at %s", path_join(dir_path, name))
+                        continue
+                except OSError:
+                    continue
+            sub_ignores = tuple((prefix + name + "/", patterns)
+                                for prefix, patterns in ignores)
+            kept_sub_dirs.append((name, (depth + 1, device, sub_ignores)))
+        return kept_note_names, kept_sub_dirs
+
+
+def scan_dir(dir_path, match, snapshots, rules, state):
+    """
+    Lists a single directory using ``os.scandir`` or looks it up in
+    ``snapshots`` (if not ``None``, see ``DirSnapshots``) and applies
+    ``rules`` (see ``WalkRules``) with the directory's ``state``.
+
+    Returns the paths of matching files, ``(path, state)`` of sub
+    directories to descend into and the directory's absolute path and
+    new snapshot (if the directory was listed and can be snapshotted).
+    """
+    dir_abspath = snapshot = None
+    if snapshots is not None:
+        dir_abspath = abspath(dir_path)
+        try:
+            mtime_ns = stat(dir_path).st_mtime_ns
+        except OSError as exception:
+            logging.info("cannot stat directory %s: %s", dir_path, exception)
+            return [], [], (dir_abspath, None)
+        snapshot = snapshots.get(dir_abspath, mtime_ns)
+        if snapshot is not None:
+            _, note_names, sub_dir_names, has_ignore_file = snapshot
+            return _apply_rules(dir_path, rules, state, note_names,
+                                sub_dir_names, has_ignore_file,
+                                (dir_abspath, None))
+
+    note_names = []
+    sub_dir_names = []
+    has_ignore_file = False
+    try:
+        with scandir(dir_path) as dir_entries:
+            for dir_entry in dir_entries:
+                try:
+                    is_dir = dir_entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    # like ``os.walk``, do not follow links to directories
+                    if not dir_entry.is_symlink():
+                        sub_dir_names.append(dir_entry.name)
+                elif match(dir_entry.name):
+                    note_names.append(dir_entry.name)
+                elif dir_entry.name == rules.ignore_file:
+                    has_ignore_file = True
+    except OSError as exception:
+        logging.info("cannot list directory %s: %s", dir_path, exception)
+    else:
+        if (snapshots is not None and
+                time() - mtime_ns / 1e9 > DirSnapshots.RACY_SECONDS):
+            snapshot = [mtime_ns, note_names, sub_dir_names, has_ignore_file]
+
+    return _apply_rules(dir_path, rules, state, note_names, sub_dir_names,
+                        has_ignore_file, (dir_abspath, snapshot))
+
+
+def _apply_rules(dir_path, rules, state, note_names, sub_dir_names,
+                 has_ignore_file, snapshot_update):
+    note_names, sub_dirs = rules.apply(dir_path, state, note_names,
+                                       sub_dir_names, has_ignore_file)
+    # sorted by name, since ``scandir`` lists in arbitrary order
+    # (see ``walk_order_key``)
+    return ([path_join(dir_path, name) for name in sorted(note_names)],
+            [(path_join(dir_path, name), sub_state)
+             for name, sub_state in sorted(sub_dirs, key=itemgetter(0))],
+            snapshot_update)
+
+
+def _prune_nested_dirs(dir_paths, rules):
+    """
+    Returns ``dir_paths`` without directories that are (or are within)
+    another one of ``dir_paths``, since these would be walked twice.
+
+    Nested directories are kept if walking the outer one would prune
+    them or walk them by other ``rules`` (e.g. due to ignore files
+    above), since that would not find the same notes.
+    """
+    def is_within(path, other_path):
+        """
+        Returns whether ``path`` is or is within ``other_path``.
+        """
+        return (path == other_path or
+                path.startswith(other_path.rstrip(pathsep) + pathsep))
+
+    real_paths = [realpath(dir_path) for dir_path in dir_paths]
+    kept_indexes = set()
+    kept_real_paths = []
+
+    # shorter paths first, since they can contain longer ones
+    for index in sorted(range(len(dir_paths)),
+                        key=lambda i: len(real_paths[i])):
+        real_path = real_paths[index]
+        if any(is_within(real_path, kept) and
+               rules.is_root_like(real_path,
+                                  rules.state_below(kept, real_path))
+               for kept in kept_real_paths):
+            logging.debug("not walking nested directory %s", dir_paths[index])
+            continue
+        kept_real_paths.append(real_path)
+        kept_indexes.add(index)
+
+    # keep the order as specified by the user
+    return [dir_path for index, dir_path in enumerate(dir_paths)
+            if index in kept_indexes]
+
+
+def walk_order_key(path):
+    """
+    Returns a key to sort paths of notes in the order ``walk_notes``
+    submits them (e.g. for answers of the daemon to be in the same order).
+    """
+    names = path.split(pathsep)
+    # a directory's notes before its sub directories, both sorted by name
+    return [(1, name) for name in names[:-1]] + [(0, names[-1])]
+
+
+def walk_notes(args, dir_paths, found_path_callback):
+    """
+    Walks ``dir_paths`` recursively and submits paths of notes (as
+    configured via ``args``) via ``found_path_callback``.
+
+    Directories are listed in parallel using up to ``args.jobs``
+    threads, but notes are submitted in a fixed order (like ``os.walk``
+    top-down, i.e. a directory's notes before those of its sub
+    directories, both sorted by name), so listings stay the same for
+    unchanged trees.
+    The callback is always called from the calling thread.
+    Directories pruned according to ``WalkRules`` are not listed at all
+    and neither are directories served by a running daemon.
+
+    This is also meant to be used by other plugins which need to know
+    all notes below some directories.
+    """
+    match = re.compile(args.note_regex).match
+    rules = WalkRules.from_args(args)
+
+    if args.unique:
+        dir_paths = _prune_nested_dirs(dir_paths, rules)
+
+    # (the daemon walks from its own roots, so it cannot apply rules
+    # relative to the queried directories)
+    if (args.daemon and rules.max_depth is None and
+            not rules.one_file_system):
+        dir_paths = _find_via_daemon(args, rules, dir_paths,
+                                     found_path_callback)
+
+    snapshots = (DirSnapshots(args.note_regex, rules.ignore_file)
+                 if args.cache_dirs else None)
+
+    executor = ThreadPoolExecutor(max_workers=max(args.jobs, 1),
+                                  initializer=PROFILER.profile_thread)
+    try:
+        # futures in the order to handle their results (depth-first)
+        pending = deque(executor.submit(scan_dir, dir_path, match,
+                                        snapshots, rules,
+                                        rules.root_state(dir_path))
+                        for dir_path in dir_paths)
+        while pending:
+            found_paths, sub_dirs, snapshot_update = pending.popleft().result()
+
+            # keep the workers busy before we handle the results
+            pending.extendleft(reversed([
+                executor.submit(scan_dir, sub_dir_path, match, snapshots,
+                                rules, sub_dir_state)
+                for sub_dir_path, sub_dir_state in sub_dirs]))
+
+            if snapshots is not None:
+                snapshots.update(*snapshot_update)
+
+            for found_path in found_paths:
+                found_path_callback(found_path)
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+    if snapshots is not None:
+        snapshots.save(dir_paths)
+
+
+def _find_via_daemon(args, rules, dir_paths, found_path_callback):
+    """
+    Asks a running daemon (see sub command ``serve``) for notes below
+    ``dir_paths`` and submits them via ``found_path_callback``.
+
+    Returns the directories the daemon could not answer for.
+    """
+    remaining_dir_paths = []
+    for dir_path in dir_paths:
+        dir_abspath = abspath(dir_path)
+        note_abspaths = daemon.find_notes(dir_abspath, args.note_regex,
+                                          rules.context())
+        if note_abspaths is None:
+            remaining_dir_paths.append(dir_path)
+            continue
+        logging.debug("daemon found %u notes below %s", len(note_abspaths),
+                      dir_path)
+
+        # make paths look like found by walking ``dir_path``
+        prefix_length = len(dir_abspath.rstrip(pathsep)) + 1
+        for note_abspath in note_abspaths:
+            found_path_callback(path_join(dir_path,
+                                          note_abspath[prefix_length:]))
+    return remaining_dir_paths
+
+
 @Registry.register_finder
 class FileSystemFinder(AbstractBaseFinder):
     """
@@ -25,43 +526,46 @@ class FileSystemFinder(AbstractBaseFinder):
         arg_parser.add_argument('--note-regex', default=r'(.*\.)?notes?$',
                                 help='regular expression used to identify ' +
                                 'notes paths')
+        arg_parser.add_argument('--cache-dirs', action='store_true',
+                                default=False, help='cache contents of ' +
+                                'directories and list only directories ' +
+                                'changed since (e.g. for slow network ' +
+                                'file systems)')
+        arg_parser.add_argument('--ignore-file', default=".yanaignore",
+                                help='name of files with gitignore-style ' +
+                                'patterns of paths not to walk (empty to ' +
+                                'disable)')
+        arg_parser.add_argument('--exclude', action='append',
+                                metavar='PATTERN', help='do not walk ' +
+                                'directories (or pass notes) with names ' +
+                                'matching the shell-style PATTERN (can be ' +
+                                'given multiple times)')
+        arg_parser.add_argument('--no-default-excludes', action='store_false',
+                                dest='default_excludes', default=True,
+                                help='walk directories excluded by default ' +
+                                '(%s)' % ", ".join(DEFAULT_EXCLUDES))
+        arg_parser.add_argument('--hidden', action='store_true',
+                                default=False, help='walk hidden ' +
+                                'directories as well')
+        arg_parser.add_argument('--max-depth', type=int, metavar='N',
+                                help='walk at most N directory levels ' +
+                                'below queried directories')
+        arg_parser.add_argument('--one-file-system', action='store_true',
+                                default=False, help='do not walk ' +
+                                'directories on other file systems than ' +
+                                'the queried directory')
+        arg_parser.add_argument('--no-daemon', action='store_false',
+                                dest='daemon', default=True,
+                                help='do not ask a running daemon (see ' +
+                                'sub command serve) for notes')
 
-    @staticmethod
-    def _find_scandir(dir_paths, match, found_path_callback):
-        """
-        Search for matching files using the new and fast ``os.scandir``.
-        Matching files will be submitted via ``found_path_callback``.
-        """
-        from os import scandir
-        logging.debug("using scandir")
-        exclude = ('.', '..')
-        for dir_path in dir_paths:
-            for dir_entry in scandir(dir_path):
-                entry_name = dir_entry.name
-                if not dir_entry.is_file():
-                    continue
-                if entry_name in exclude:
-                    continue
-                if not match(entry_name):
-                    continue
-                logging.info("found in file system: %s", dir_entry.path)
-                found_path_callback(dir_entry.path)
-
-    @staticmethod
-    def _find_walk(dir_paths, match, found_path_callback):
-        """
-        Search for matching files w/o new (and fast ``os.scandir``).
-        Matching files will be submitted via ``found_path_callback``.
-        """
-
-
+    def walks(self, args, queries):
+        return any(isdir(q) for q in queries)
 
     def find(self, args, queries, found_path_callback):
         """
         Search for matching files in the file system.
         """
-        # IDEA: spawn new process/thread if crossing fs boundaries?
-
         match = re.compile(args.note_regex).match
 
         dir_paths = []
@@ -71,11 +575,12 @@ class FileSystemFinder(AbstractBaseFinder):
             elif (isfile(query) or args.new) and match(query):
                 found_path_callback(query)
 
-        logging.debug("walking file system")
-        for dir_path in dir_paths:
-            for root, _, files in walk(dir_path):
-                for file_path in files:
-                    if match(file_path):
-                        full_path = path_join(root, file_path)
-                        logging.info("found in file system: %s", full_path)
-                        found_path_callback(full_path)
+        def walked_path_callback(path):
+            """
+            Logs and submits paths found while walking.
+            """
+            logging.info("found in file system: %s", path)
+            found_path_callback(path)
+
+        logging.debug("walking file system using %u jobs", args.jobs)
+        walk_notes(args, dir_paths, walked_path_callback)
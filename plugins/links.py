@@ -0,0 +1,133 @@
+"""
+Implements plugins to filter notes by links between them.
+
+Links are looked up in the link cache of ``Note`` (an index of forward
+and reverse edges), so notes are only read if they changed since their
+links were cached.
+"""
+
+import re
+from argparse import Action, ArgumentError
+from os.path import abspath, basename
+
+from plugins import Registry, AbstractBaseFilter
+
+from lib.note import Note
+
+
+class _HopsAndNoteAction(Action):
+    """
+    Appends ``(number of hops, note)`` for options like ``--within N X``.
+    """
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        hops, note_path = values
+        try:
+            hops = int(hops)
+        except ValueError:
+            raise ArgumentError(self, "invalid number of hops: %r" % hops)
+        items = list(getattr(namespace, self.dest) or [])
+        items.append((hops, note_path))
+        setattr(namespace, self.dest, items)
+
+
+def neighborhood(note_abspath, hops, note_regex):
+    """
+    Returns the absolute paths of all notes at most ``hops`` links away
+    from ``note_abspath`` (in either direction) mapped to their distance.
+
+    Only link targets with names matching ``note_regex`` are notes, so
+    other files (e.g. images) are neither read nor passed through.
+    """
+    is_note = re.compile(note_regex).match
+    distances = {note_abspath: 0}
+    frontier = [note_abspath]
+    for distance in range(1, hops + 1):
+        next_frontier = []
+        for frontier_abspath in frontier:
+            for linked_abspath in Note.linked_abspaths(frontier_abspath):
+                if (linked_abspath not in distances and
+                        is_note(basename(linked_abspath))):
+                    distances[linked_abspath] = distance
+                    next_frontier.append(linked_abspath)
+        frontier = next_frontier
+    return distances
+
+
+@Registry.register_filter
+class LinksToFilter(AbstractBaseFilter):
+    """
+    A filter that passes on only notes linking to any of the
+    user-provided notes.
+    """
+
+    def set_up(self, arg_parser):
+        arg_parser.add_argument('--links-to', action='append',
+                                metavar='NOTE', help='only pass notes ' +
+                                'linking to NOTE (can be given multiple ' +
+                                'times)')
+
+    def predicate(self, args):
+        if not args.links_to:
+            return None
+
+        target_abspaths = set(abspath(p) for p in args.links_to)
+        candidate_abspaths = set()
+        for target_abspath in target_abspaths:
+            candidate_abspaths.update(
+                Note.cached_abspaths_linking_to(target_abspath))
+
+        def links_to_target(path):
+            """
+            Returns whether the note at ``path`` links to a target.
+            """
+            note = Note(path)
+            if note.has_cached_links():
+                return note.abspath in candidate_abspaths
+            return not target_abspaths.isdisjoint(note.links)
+
+        return links_to_target
+
+
+@Registry.register_filter
+class WithinFilter(AbstractBaseFilter):
+    """
+    A filter that passes on only notes which are connected to any of the
+    user-provided notes by at most the given number of links (in either
+    direction).
+
+    The neighborhood is determined once by a breadth-first search over
+    the link cache, reading notes on the way only if they changed.
+    Notes found which changed since their links were cached are checked
+    by their own links additionally.
+    """
+
+    def set_up(self, arg_parser):
+        arg_parser.add_argument('--within', action=_HopsAndNoteAction,
+                                nargs=2, metavar=('N', 'NOTE'),
+                                help='only pass notes at most N links ' +
+                                'away from NOTE (can be given multiple ' +
+                                'times)')
+
+    def predicate(self, args):
+        if not args.within:
+            return None
+
+        neighborhoods = [(hops, neighborhood(abspath(p), hops,
+                                             args.note_regex))
+                         for hops, p in args.within]
+
+        def is_within(path):
+            """
+            Returns whether the note at ``path`` is close enough.
+            """
+            note = Note(path)
+            if any(note.abspath in d for _, d in neighborhoods):
+                return True
+            if note.has_cached_links():
+                return False
+            links = note.links
+            return any(d.get(l, hops) < hops for hops, d in neighborhoods
+                       for l in links)
+
+        return is_within
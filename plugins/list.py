@@ -4,25 +4,202 @@ run by their list index or by pattern-matching their paths.
 """
 
 import logging
-from fnmatch import filter as fnmatch_filter
-from os import sep as pathsep, linesep, remove
+import re
+from bisect import bisect_left
+from fnmatch import translate
+from os import sep as pathsep, linesep, getpid, replace, pread, fsencode, \
+    fsdecode, open as os_open, close, O_RDONLY
 from os.path import split as path_split, join as path_join, isfile
-from json import dump, load
+from struct import Struct
+from sys import maxunicode
+from threading import Lock
 import abc
 
-from lib import CACHE_DIR
+from lib import CACHE_DIR, make_cache_dir
 from lib.printing import (print_colored, print_colored_2, print_default,
                           print_highlighted)
 from plugins import Registry, AbstractBaseSubCommand, AbstractBaseFinder
 
-LIST_CACHE_FILE = path_join(CACHE_DIR, "list_cache.json")
+LIST_CACHE_FILE = path_join(CACHE_DIR, "list_cache.bin")
+
+_HAS_MAGIC = re.compile(r"[*?[]").search
+
+
+class _SortedPaths(object):
+    """
+    Read-only sequence of the paths of a ``LastListing`` in sorted order
+    (e.g. for ``bisect``), reading paths on demand.
+    """
+
+    def __init__(self, last_listing):
+        self.last_listing = last_listing
+
+    def __len__(self):
+        return len(self.last_listing)
+
+    def __getitem__(self, position):
+        return self.last_listing.path(
+            self.last_listing.sorted_index(position))
+
+
+class LastListing(object):
+    """
+    The paths listed last time by the list sub command.
+
+    They are stored in ``LIST_CACHE_FILE`` as a header (magic, number of
+    paths), a table of offsets, the NUL-terminated paths and the indexes
+    of the paths in sorted order. That way, a single path can be read by
+    its index and paths with a given prefix can be looked up by bisection
+    without reading the whole file.
+    The file is opened on first use only.
+    """
+
+    MAGIC = b"YLC2"
+    HEADER = Struct("<4sI")
+    OFFSET = Struct("<Q")
+    INDEX = Struct("<I")
+
+    def __init__(self, file_name=LIST_CACHE_FILE):
+        self.file_name = file_name
+        self._lock = Lock()
+        self._fd = None
+        self._count = None
+        self._data_offset = None
+        self._order_offset = None
+        self._paths = None
+
+    def _open(self):
+        """
+        Opens the file and reads its header (once).
+        """
+        with self._lock:
+            if self._count is not None:
+                return
+            count = 0
+            try:
+                fd = os_open(self.file_name, O_RDONLY)
+            except OSError:
+                pass
+            else:
+                header = pread(fd, self.HEADER.size, 0)
+                if len(header) == self.HEADER.size:
+                    magic, count = self.HEADER.unpack(header)
+                    if magic != self.MAGIC:
+                        logging.debug("discarding cache file %s",
+                                      self.file_name)
+                        count = 0
+                if count:
+                    # kept open for reading paths on demand
+                    self._fd = fd
+                    self._data_offset = (self.HEADER.size +
+                                         (count + 1) * self.OFFSET.size)
+                    self._order_offset = self._data_offset + self._offset(
+                        count)
+                else:
+                    close(fd)
+            logging.debug("last listing contains %u paths", count)
+            self._count = count
+
+    def __len__(self):
+        self._open()
+        return self._count
+
+    def _offset(self, index):
+        """
+        Returns where the path at ``index`` starts within the paths.
+        """
+        return self.OFFSET.unpack(pread(
+            self._fd, self.OFFSET.size,
+            self.HEADER.size + index * self.OFFSET.size))[0]
+
+    def path(self, index):
+        """
+        Returns the path at ``index`` (starting at 0).
+        """
+        offsets_data = pread(self._fd, 2 * self.OFFSET.size,
+                             self.HEADER.size + index * self.OFFSET.size)
+        start = self.OFFSET.unpack_from(offsets_data, 0)[0]
+        end = self.OFFSET.unpack_from(offsets_data, self.OFFSET.size)[0]
+        return fsdecode(pread(self._fd, end - start - 1,
+                              self._data_offset + start))
+
+    def sorted_index(self, position):
+        """
+        Returns the index of the path at ``position`` in sorted order.
+        """
+        return self.INDEX.unpack(pread(
+            self._fd, self.INDEX.size,
+            self._order_offset + position * self.INDEX.size))[0]
+
+    def get(self, index):
+        """
+        Returns the path listed at ``index`` (starting at 1, negative
+        indexes count from the end) or ``None`` if there is none.
+        """
+        count = len(self)
+        if 0 < index <= count:
+            return self.path(index - 1)
+        elif 0 < -index <= count:
+            return self.path(index + count)
+        return None
+
+    def indexes_with_prefix(self, prefix):
+        """
+        Returns the indexes (starting at 0) of all paths starting with
+        ``prefix``.
+        """
+        if len(self) == 0:
+            return []
+        sorted_paths = _SortedPaths(self)
+        start = bisect_left(sorted_paths, prefix)
+        end = bisect_left(sorted_paths, prefix + chr(maxunicode), lo=start)
+        order_data = pread(self._fd, (end - start) * self.INDEX.size,
+                           self._order_offset + start * self.INDEX.size)
+        return [i for i, in self.INDEX.iter_unpack(order_data)]
+
+    def paths(self):
+        """
+        Returns all paths listed (read once).
+        """
+        if len(self) == 0:
+            return []
+        with self._lock:
+            if self._paths is None:
+                data = pread(self._fd,
+                             self._order_offset - self._data_offset,
+                             self._data_offset)
+                self._paths = [fsdecode(p) for p in data.split(b"\0")[:-1]]
+            return self._paths
+
+    @classmethod
+    def save(cls, paths, file_name=LIST_CACHE_FILE):
+        """
+        Writes ``paths`` atomically (see ``JsonCacheFile.save``).
+        """
+        make_cache_dir()
+        encoded_paths = [fsencode(p) + b"\0" for p in paths]
+        offsets = [0]
+        for encoded_path in encoded_paths:
+            offsets.append(offsets[-1] + len(encoded_path))
+        order = sorted(range(len(paths)), key=paths.__getitem__)
+
+        temp_file_name = "%s.%u.tmp" % (file_name, getpid())
+        with open(temp_file_name, "wb") as cache_file:
+            cache_file.write(cls.HEADER.pack(cls.MAGIC, len(paths)))
+            cache_file.write(b"".join(cls.OFFSET.pack(o) for o in offsets))
+            cache_file.write(b"".join(encoded_paths))
+            cache_file.write(b"".join(cls.INDEX.pack(i) for i in order))
+        replace(temp_file_name, file_name)
+
+LAST_LISTING = LastListing()
+""" shared by the finders below, so it is read at most once """
 
 
 class BaseLastListingFinder(AbstractBaseFinder):
     """
     A common base class for finders that operate on last listed notes.
 
-    This mainly deals with loading cached paths.
+    The last listing is only read if a query may refer to it.
     """
 
     # disable check for not overridden abstract methods:
@@ -33,25 +210,20 @@ class BaseLastListingFinder(AbstractBaseFinder):
     #  #comment33806701_22224042)
     __metaclass__ = abc.ABCMeta
 
-    def set_up(self, *_):
-        self.load_last_listed_paths()
+    def walks(self, args, queries):
+        return False
 
-    def load_last_listed_paths(self):
+    @staticmethod
+    def found_if_exists(path, found_path_callback):
         """
-        Loads paths that were found last time using the list sub command.
+        Calls ``found_path_callback`` for ``path`` unless the note was
+        removed since it was listed.
         """
-        file_name = LIST_CACHE_FILE
-        paths = []
-        if isfile(file_name):
-            with open(file_name, "r") as cache_file:
-                try:
-                    paths = load(cache_file) or []
-                except ValueError:
-                    remove(file_name)
-                else:
-                    paths = [p for p in paths if isfile(p)]
-        logging.debug("loaded %u paths from last listing", len(paths))
-        self.last_listed_paths = paths
+        if isfile(path):
+            found_path_callback(path)
+        else:
+            logging.info("skipping last listed note not existing anymore: %s",
+                         path)
 
 @Registry.register_finder
 class LastListingIndexFinder(BaseLastListingFinder):
@@ -71,20 +243,12 @@ class LastListingIndexFinder(BaseLastListingFinder):
             try:
                 index = int(query)
             except ValueError:
-                return
+                continue
 
-            # abs() to allow use of negative indexing
-            abs_index = abs(index)
-            print(abs_index, len(self.last_listed_paths))
-            if abs_index > 0 and abs_index <= len(self.last_listed_paths):
-
-                # for positive numbers, make indexing start at 1
-                if index > 0:
-                    index -= 1
-
-                path = self.last_listed_paths[index]
+            path = LAST_LISTING.get(index)
+            if path is not None:
                 logging.info("found by index in cache: %s", path)
-                found_path_callback(path)
+                self.found_if_exists(path, found_path_callback)
 
 @Registry.register_finder
 class LastListingRunMatchFinder(BaseLastListingFinder):
@@ -101,10 +265,28 @@ class LastListingRunMatchFinder(BaseLastListingFinder):
         patterns specified in ``queries``.
         """
 
-        for query in queries:
-            for matched_path in fnmatch_filter(self.last_listed_paths, query):
-                logging.info("found by match in cache: %s", matched_path)
-                found_path_callback(matched_path)
+        patterns = [q for q in queries if _HAS_MAGIC(q)]
+        if not patterns:
+            return
+
+        # a single regular expression for all patterns and, if all patterns
+        # start with some literal, only paths with these prefixes to check
+        match = re.compile("|".join(translate(p) for p in patterns)).match
+        prefixes = [p[:_HAS_MAGIC(p).start()] for p in patterns]
+        if all(prefixes):
+            indexes = set()
+            for prefix in prefixes:
+                indexes.update(LAST_LISTING.indexes_with_prefix(prefix))
+            logging.debug("matching %u last listed paths by prefix",
+                          len(indexes))
+            candidates = (LAST_LISTING.path(i) for i in sorted(indexes))
+        else:
+            candidates = LAST_LISTING.paths()
+
+        for path in candidates:
+            if match(path):
+                logging.info("found by match in cache: %s", path)
+                self.found_if_exists(path, found_path_callback)
 
 @Registry.register_sub_command
 class ListSubCommand(AbstractBaseSubCommand):
@@ -130,8 +312,7 @@ class ListSubCommand(AbstractBaseSubCommand):
         """
         if not self.invoked:
             return
-        with open(LIST_CACHE_FILE, "w") as cache_file:
-            dump(self.listed_paths, cache_file)
+        LastListing.save(self.listed_paths)
 
     def invoke(self, *args, **kwargs):
         """
@@ -0,0 +1,330 @@
+"""
+Implements a daemon which keeps notes and their tags in memory, kept
+current using inotify, and answers queries of other yana processes.
+
+Clients ask for the notes below a directory, optionally only for those
+with tags matching a pattern (see ``--tag-filter``). Sub commands which
+show tags (e.g. ``tags`` or ``list -t``) still get them through the tag
+cache, which the daemon keeps current.
+"""
+
+import logging
+import re
+import socket
+from os import remove, chmod, sep as pathsep
+from os.path import abspath, exists, isdir, join as path_join
+from selectors import DefaultSelector, EVENT_READ
+from signal import signal, SIGTERM
+from time import time
+
+from lib import make_cache_dir
+from lib.daemon import SOCKET_PATH, TIMEOUT, send_message, receive_message
+from lib.inotify import Inotify, IN_CLOSE_WRITE, IN_MOVED_FROM, \
+    IN_MOVED_TO, IN_CREATE, IN_DELETE, IN_DELETE_SELF, IN_MOVE_SELF, \
+    IN_Q_OVERFLOW, IN_IGNORED, IN_ONLYDIR, IN_ISDIR
+from lib.note import Note
+from lib.printing import print_default, flush_output
+from plugins import Registry, AbstractBaseSubCommand
+from plugins.file_system import scan_dir, walk_order_key, WalkRules
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+SAVE_INTERVAL = 10
+""" seconds to wait at least between saving caches """
+
+
+def _terminate(signal_number, _):
+    """
+    Exits (running clean-ups on the way) when receiving a signal.
+    """
+    raise SystemExit(128 + signal_number)
+
+
+class NoteDaemon(object):
+    """
+    Keeps the notes below some root directories in memory and serves
+    requests for them via a Unix domain socket.
+    """
+
+    def __init__(self, roots, note_regex, tag_regex, rules):
+        self.roots = [abspath(root) for root in roots]
+        self.note_regex = note_regex
+        self.tag_regex = tag_regex
+        self.match = re.compile(note_regex).match
+        self.rules = rules
+        self.states = {}
+        """ directory -> state to walk it with (see ``WalkRules``) """
+        self.inotify = Inotify()
+        self.notes = {}
+        """ directory -> {name of note within -> tags of note} """
+        self.watches = {}
+        """ watch descriptor -> directory """
+        self.unwatched = set()
+        """ directories which we could not watch """
+        self.caches_dirty = False
+        self.last_save_time = time()
+
+    def _add_tree(self, root, state):
+        """
+        Starts watching ``root`` and all directories below (which are not
+        pruned) and reads their notes (and tags).
+        """
+        pending = [(root, state)]
+        while pending:
+            dir_path, state = pending.pop()
+            try:
+                watch_descriptor = self.inotify.add_watch(dir_path,
+                                                          WATCH_MASK)
+            except OSError as exception:
+                logging.warning("cannot watch %s: %s", dir_path, exception)
+                self.unwatched.add(dir_path)
+                continue
+            self.watches[watch_descriptor] = dir_path
+            self.states[dir_path] = state
+            note_paths, sub_dirs, _ = scan_dir(dir_path, self.match, None,
+                                               self.rules, state)
+            self.notes[dir_path] = dict(
+                (p[len(dir_path) + 1:], self._read_tags(p))
+                for p in note_paths)
+            pending.extend(sub_dirs)
+
+    def _remove_tree(self, root):
+        """
+        Forgets about ``root`` and all directories below.
+        """
+        prefix = root + pathsep
+        for watch_descriptor, dir_path in list(self.watches.items()):
+            if dir_path == root or dir_path.startswith(prefix):
+                self.inotify.rm_watch(watch_descriptor)
+                del self.watches[watch_descriptor]
+        for dir_paths in (self.notes, self.states):
+            for dir_path in list(dir_paths):
+                if dir_path == root or dir_path.startswith(prefix):
+                    del dir_paths[dir_path]
+        self.unwatched = set(d for d in self.unwatched
+                             if d != root and not d.startswith(prefix))
+
+    def _apply_rules(self, dir_path, note_names, sub_dir_names):
+        """
+        Returns which of the given entries of ``dir_path`` are not pruned
+        (see ``WalkRules.apply``).
+        """
+        has_ignore_file = bool(self.rules.ignore_file) and exists(
+            path_join(dir_path, self.rules.ignore_file))
+        return self.rules.apply(dir_path, self.states[dir_path], note_names,
+                                sub_dir_names, has_ignore_file)
+
+    def _read_tags(self, note_path):
+        # reading tags updates the tag cache
+        self.caches_dirty = True
+        return tuple(Note(note_path).tags)
+
+    def rescan(self):
+        """
+        Reads everything from scratch (e.g. initially).
+        """
+        for root in self.roots:
+            self._remove_tree(root)
+        for root in self.roots:
+            logging.info("reading notes below %s", root)
+            self._add_tree(root, self.rules.root_state(root))
+        logging.info("watching %u directories", len(self.watches))
+
+    def handle_events(self):
+        """
+        Updates what we know according to pending inotify events.
+        """
+        for watch_descriptor, mask, _, name in self.inotify.read_events():
+            if mask & IN_Q_OVERFLOW:
+                logging.warning("missed file system events, rescanning")
+                self.rescan()
+                return
+
+            dir_path = self.watches.get(watch_descriptor)
+            if dir_path is None:
+                continue
+
+            if mask & IN_IGNORED:
+                # watch removed, e.g. since the directory was deleted
+                del self.watches[watch_descriptor]
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                self._remove_tree(dir_path)
+                continue
+
+            path = path_join(dir_path, name)
+            logging.debug("inotify event %#x for %s", mask, path)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    for sub_dir_name, state in self._apply_rules(
+                            dir_path, [], [name])[1]:
+                        self._add_tree(path_join(dir_path, sub_dir_name),
+                                       state)
+                elif mask & IN_MOVED_FROM:
+                    self._remove_tree(path)
+            elif name == self.rules.ignore_file:
+                # rules for everything below changed
+                logging.info("ignore file %s changed, rescanning", path)
+                state = self.states[dir_path]
+                self._remove_tree(dir_path)
+                self._add_tree(dir_path, state)
+            elif self.match(name):
+                notes = self.notes.setdefault(dir_path, {})
+                if mask & (IN_DELETE | IN_MOVED_FROM):
+                    notes.pop(name, None)
+                elif self._apply_rules(dir_path, [name], [])[0]:
+                    if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                        notes[name] = self._read_tags(path)
+                    else:
+                        # e.g. just created, tags follow when written
+                        notes.setdefault(name, ())
+
+    def handle_request(self, message):
+        """
+        Returns the response to a request ``message``.
+        """
+        if message.get("command") != "find":
+            return {"error": "unknown command"}
+        if message.get("note_regex") != self.note_regex:
+            return {"error": "different note regex"}
+        if message.get("walk_rules") != self.rules.context():
+            return {"error": "different walk rules"}
+        tag_matches = None
+        if message.get("tag_pattern") is not None:
+            if message.get("tag_regex") != self.tag_regex:
+                return {"error": "different tag regex"}
+            try:
+                tag_matches = re.compile(message["tag_pattern"]).match
+            except re.error:
+                return {"error": "invalid tag pattern"}
+
+        dir_path = message["dir"].rstrip(pathsep) or pathsep
+        if not any(dir_path == root or dir_path.startswith(root + pathsep)
+                   for root in self.roots):
+            return {"error": "not below served directories"}
+        # walking ``dir_path`` itself must find the same notes, so it must
+        # not be pruned or walked with rules inherited from above
+        state = self.states.get(dir_path)
+        if state is None:
+            return {"error": "not walked by the daemon"}
+        if not self.rules.is_root_like(dir_path, state):
+            return {"error": "walked by other rules"}
+        prefix = dir_path + pathsep
+        if any(d == dir_path or d.startswith(prefix)
+               for d in self.unwatched):
+            return {"error": "not all directories are watched"}
+
+        paths = []
+        for notes_dir_path, notes in self.notes.items():
+            if notes_dir_path == dir_path or notes_dir_path.startswith(prefix):
+                paths.extend(path_join(notes_dir_path, name)
+                             for name, tags in notes.items()
+                             if tag_matches is None or
+                             any(tag_matches(tag) for tag in tags))
+        # like found by walking ``dir_path``, for stable last listings
+        paths.sort(key=walk_order_key)
+        return {"paths": paths}
+
+    def _handle_connection(self, server_socket):
+        connection, _ = server_socket.accept()
+        connection.settimeout(TIMEOUT)
+        try:
+            message = receive_message(connection)
+            if message is not None:
+                send_message(connection, self.handle_request(message))
+        except (OSError, ValueError) as exception:
+            logging.info("failed to serve request: %s", exception)
+        finally:
+            connection.close()
+
+    def _save_caches_if_due(self):
+        if self.caches_dirty and time() - self.last_save_time > SAVE_INTERVAL:
+            Note.save_caches()
+            self.caches_dirty = False
+            self.last_save_time = time()
+
+    def serve_forever(self):
+        """
+        Reads all notes and serves requests until interrupted.
+        """
+        make_cache_dir()
+        if exists(SOCKET_PATH):
+            if self._socket_in_use():
+                raise RuntimeError("daemon already running (%s)" %
+                                   SOCKET_PATH)
+            remove(SOCKET_PATH)
+
+        server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server_socket.bind(SOCKET_PATH)
+        chmod(SOCKET_PATH, 0o600)
+
+        selector = DefaultSelector()
+        # clean up like on ``KeyboardInterrupt`` (e.g. for ``kill``)
+        previous_handler = signal(SIGTERM, _terminate)
+        try:
+            self.rescan()
+            server_socket.listen(16)
+            selector.register(server_socket, EVENT_READ)
+            selector.register(self.inotify, EVENT_READ)
+            while True:
+                for key, _ in selector.select(timeout=SAVE_INTERVAL):
+                    if key.fileobj is server_socket:
+                        self._handle_connection(server_socket)
+                    else:
+                        self.handle_events()
+                self._save_caches_if_due()
+        finally:
+            selector.close()
+            server_socket.close()
+            remove(SOCKET_PATH)
+            self.inotify.close()
+            Note.save_caches()
+            signal(SIGTERM, previous_handler)
+
+    @staticmethod
+    def _socket_in_use():
+        """
+        Returns whether some process listens on ``SOCKET_PATH``.
+        """
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(SOCKET_PATH)
+        except OSError:
+            return False
+        finally:
+            probe.close()
+        return True
+
+
+@Registry.register_sub_command
+class ServeSubCommand(AbstractBaseSubCommand):
+    """
+    Runs a daemon that keeps notes below the queried directories in
+    memory, so other invocations do not have to walk the file system.
+    Other invocations use the daemon automatically if it is running.
+    """
+
+    sub_command = "serve"
+    sub_command_help = "run a daemon to answer queries for notes quickly"
+
+    # we read the directories ourselves (to watch them as well)
+    uses_finders = False
+
+    def invoke(self, args, note_q_get):
+        queries = [args.query] if isinstance(args.query, str) else args.query
+        not_dirs = [q for q in queries if not isdir(q)]
+        if not_dirs:
+            logging.error("cannot serve %s: not a directory",
+                          ", ".join(not_dirs))
+            return
+
+        daemon = NoteDaemon(queries, args.note_regex, args.tag_regex,
+                            WalkRules.from_args(args))
+        print_default("serving notes below %s via %s\n" % (
+            ", ".join(daemon.roots), SOCKET_PATH), interactive_only=True)
+        flush_output()
+        try:
+            daemon.serve_forever()
+        except RuntimeError as exception:
+            print_default("%s\n" % exception, interactive_only=True)
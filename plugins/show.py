@@ -2,17 +2,56 @@
 Implements plugins to show (think: cat) plugins.
 """
 
+import sys
+from io import UnsupportedOperation
+from os import linesep, sendfile, fstat
 from shutil import copyfileobj
-from sys import stdout
-from os import linesep
 
 from plugins import Registry, AbstractBaseSubCommand
-from lib.printing import print_colored
+from lib.printing import print_colored, flush_output, OUTPUT_BUFFER
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+def _stdout_fd():
+    """
+    Returns the file descriptor of stdout if we may write to it directly
+    (i.e. it is a file or pipe) or ``None`` otherwise.
+    """
+    if OUTPUT_BUFFER.isatty(sys.stdout):
+        return None
+    try:
+        return sys.stdout.fileno()
+    except (AttributeError, UnsupportedOperation):
+        return None
+
+def _send_file(in_fd, out_fd):
+    """
+    Copies the file ``in_fd`` to ``out_fd`` within the kernel.
+
+    Returns ``False`` if ``sendfile`` is not supported for these files
+    (before anything was copied).
+    """
+    offset = 0
+    size = fstat(in_fd).st_size
+    while True:
+        try:
+            sent = sendfile(out_fd, in_fd, offset, max(size - offset,
+                                                       COPY_BUFFER_SIZE))
+        except OSError:
+            if offset == 0:
+                return False
+            raise
+        if sent == 0:
+            return True
+        offset += sent
 
 @Registry.register_sub_command
 class ShowSubCommand(AbstractBaseSubCommand):
     """
     A simple plugin that prints the contents of notes found to stdout.
+
+    Contents are copied as raw bytes, using ``sendfile`` if stdout is a
+    file or pipe.
     """
 
     sub_command = "show"
@@ -20,5 +59,11 @@ class ShowSubCommand(AbstractBaseSubCommand):
 
     def invoke_on_note(self, args, note):
         print_colored("%s%s" % (note.path, linesep), interactive_only=True)
-        with open(note.path, "r") as note_file:
-            copyfileobj(note_file, stdout)
+        flush_output()
+        sys.stdout.flush()
+        with open(note.path, "rb") as note_file:
+            out_fd = _stdout_fd()
+            if out_fd is not None and _send_file(note_file.fileno(), out_fd):
+                return
+            copyfileobj(note_file, sys.stdout.buffer, COPY_BUFFER_SIZE)
+            sys.stdout.buffer.flush()
@@ -0,0 +1,130 @@
+"""
+Implements a plugin to replace tags in notes.
+"""
+
+import logging
+from os import remove, replace, fdopen
+from os.path import realpath, dirname, basename
+from shutil import copymode
+from tempfile import mkstemp
+
+from plugins import Registry, AbstractBaseSubCommand
+
+from lib.note import Note
+from lib.pool import map_note_chunks
+from lib.printing import print_default
+from lib.scanning import file_contains, ENCODING
+
+
+def _may_contain_tag(note, tag):
+    """
+    Returns whether ``note`` may contain ``tag`` without reading it if
+    its tags are cached.
+    """
+    if note.has_cached_tags():
+        return tag in note.tags
+    return file_contains(note.abspath, tag.encode(ENCODING))
+
+
+def _replace_tag_in_file(path, old_tag, new_tag, dry_run):
+    """
+    Replaces ``old_tag`` by ``new_tag`` in the file at ``path`` and
+    returns the number of replacements.
+
+    The file is streamed (line by line if possible) to a temporary file
+    next to it, which replaces the file atomically if anything changed.
+    """
+    path = realpath(path)
+    with open(path, "r", encoding=ENCODING, errors="surrogateescape",
+              newline="") as note_file:
+        if Note.tags_are_line_local():
+            chunks = note_file
+        else:
+            chunks = [note_file.read()]
+
+        if dry_run:
+            return sum(Note.replace_tag(c, old_tag, new_tag)[1]
+                       for c in chunks)
+
+        temp_fd, temp_path = mkstemp(dir=dirname(path),
+                                     prefix=".%s." % basename(path),
+                                     suffix=".tmp")
+        count = 0
+        replaced = False
+        try:
+            with fdopen(temp_fd, "w", encoding=ENCODING,
+                        errors="surrogateescape", newline="") as temp_file:
+                for chunk in chunks:
+                    chunk, chunk_count = Note.replace_tag(chunk, old_tag,
+                                                          new_tag)
+                    count += chunk_count
+                    temp_file.write(chunk)
+            if count:
+                copymode(path, temp_path)
+                replace(temp_path, path)
+                replaced = True
+        finally:
+            if not replaced:
+                remove(temp_path)
+    return count
+
+
+def _replace_tag(note_paths, old_tag, new_tag, dry_run):
+    """
+    Replaces ``old_tag`` by ``new_tag`` in the notes at ``note_paths`` and
+    returns a list of ``(path, number of replacements)`` for changed notes
+    as well as changes to the tag cache.
+
+    This is run in worker processes.
+    """
+    changed = []
+    for note_path in note_paths:
+        note = Note(note_path)
+        try:
+            if not _may_contain_tag(note, old_tag):
+                continue
+            count = _replace_tag_in_file(note_path, old_tag, new_tag,
+                                         dry_run)
+        except (OSError, UnicodeError) as exception:
+            logging.error("cannot replace tag in %s: %s", note_path,
+                          exception)
+            continue
+        if count:
+            changed.append((note_path, count))
+    return changed, Note.pop_tag_cache_changes()
+
+
+@Registry.register_sub_command
+class TagReplaceSubCommand(AbstractBaseSubCommand):
+    """
+    A sub command that replaces a tag by another one in all notes found.
+
+    Notes are processed in parallel and each note is replaced atomically.
+    Notes whose cached tags do not include the old tag or which do not
+    contain it at all are skipped without rewriting them.
+    """
+
+    sub_command = "tag-replace"
+    sub_command_help = "replace a tag in notes"
+
+    def set_up(self, arg_parser):
+        arg_parser.add_argument('-n', '--dry-run', action='store_true',
+                                default=False, help='only report which ' +
+                                'notes would change')
+        arg_parser.add_argument('old_tag', help='tag to replace (w/o "#")')
+        arg_parser.add_argument('new_tag', help='replacement (w/o "#")')
+
+    def invoke(self, args, note_q_get):
+        changed_notes = 0
+        replaced_tags = 0
+        for changed in map_note_chunks(args, note_q_get, _replace_tag,
+                                       args.old_tag, args.new_tag,
+                                       args.dry_run):
+            for note_path, count in changed:
+                print_default("%s\n" % note_path)
+                changed_notes += 1
+                replaced_tags += count
+
+        print_default("%s %u tags in %u notes\n" % (
+            "would replace" if args.dry_run else "replaced", replaced_tags,
+            changed_notes), interactive_only=True)
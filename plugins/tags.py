@@ -1,12 +1,34 @@
 """
-Implements plugins to view tags of notes.
+Implements plugins to view tags of notes and to filter notes by tags.
 """
 
-from plugins import Registry, AbstractBaseSubCommand
+import re
+from fnmatch import translate
+from os.path import abspath, isdir
 
-from lib import QUEUE_END_SYMBOL
+from plugins import Registry, AbstractBaseSubCommand, AbstractBaseFilter
+from plugins.file_system import WalkRules
+
+from lib import daemon
+from lib.note import Note
 from lib.printing import print_colored_2, print_default
 
+
+def _collect_tags(note_paths):
+    """
+    Returns which tags can be found in which of the notes at
+    ``note_paths`` (as dict tag -> list of paths) as well as changes to
+    the tag cache.
+
+    This is run in worker processes.
+    """
+    tags_and_paths = {}
+    for note_path in note_paths:
+        for tag in Note(note_path).tags:
+            tags_and_paths.setdefault(tag, []).append(note_path)
+    return tags_and_paths, Note.pop_tag_cache_changes()
+
+
 @Registry.register_sub_command
 class TagsSubCommand(AbstractBaseSubCommand):
     """
@@ -38,16 +60,19 @@ class TagsSubCommand(AbstractBaseSubCommand):
             super(TagsSubCommand, self).invoke(args, note_q_get)
             return
 
+        # imported here only, since this module is loaded on every start
+        # for ``TagFilter``
+        from lib.pool import map_note_chunks
+
         # collect all tags and if required all corresponding notes
-        tags_and_notes = {}
-        for note in set(iter(note_q_get, QUEUE_END_SYMBOL)):
-            for tag in note.tags:
-                notes = tags_and_notes.setdefault(tag, set())
-                if args.notes:
-                    notes.add(note)
+        tags_and_paths = {}
+        for partial_tags_and_paths in map_note_chunks(args, note_q_get,
+                                                       _collect_tags):
+            for tag, paths in partial_tags_and_paths.items():
+                tags_and_paths.setdefault(tag, []).extend(paths)
 
         # sort the tags if need be
-        tags = tags_and_notes.keys()
+        tags = list(tags_and_paths)
         if args.sort:
             tags.sort(key=lambda s: s.lower())
 
@@ -55,8 +80,11 @@ class TagsSubCommand(AbstractBaseSubCommand):
         for tag in tags:
             print_colored_2("#%s\n" % tag)
             if args.notes:
-                for note in tags_and_notes[tag]:
-                    print_default("\t%s\n" % note)
+                paths = tags_and_paths[tag]
+                if args.sort:
+                    paths.sort()
+                for path in paths:
+                    print_default("\t%s\n" % path)
 
     def invoke_on_note(self, args, note):
         """
@@ -66,3 +94,79 @@ class TagsSubCommand(AbstractBaseSubCommand):
         for tag in set(note.tags) - self._printed_tags:
             print_colored_2("#%s\n" % tag)
             self._printed_tags.add(tag)
+
+
+@Registry.register_filter
+class TagFilter(AbstractBaseFilter):
+    """
+    A filter that passes on only notes with a tag matching any of the
+    user-provided patterns.
+
+    For notes below queried directories served by a running daemon (see
+    sub command ``serve``), the daemon's index of tags is asked once.
+    Tags of other notes are looked up in the tag cache, so only notes
+    which changed since their tags were cached are read.
+    """
+
+    def set_up(self, arg_parser):
+        arg_parser.add_argument('-T', '--tag-filter', action='append',
+                                metavar='PATTERN', help='only pass notes ' +
+                                'with a tag matching the shell-style ' +
+                                'PATTERN (can be given multiple times; ' +
+                                'answered by a running daemon if any, ' +
+                                'otherwise by the tag cache, which ' +
+                                'reads only notes changed since)')
+
+    def predicate(self, args):
+        if not args.tag_filter:
+            return None
+
+        tag_pattern = "|".join(translate(p) for p in args.tag_filter)
+        tag_matches = re.compile(tag_pattern).match
+        served_abspaths, tagged_abspaths = _ask_daemon(args, tag_pattern)
+
+        def has_matching_tag(path):
+            """
+            Returns whether the note at ``path`` has a matching tag.
+            """
+            if served_abspaths:
+                note_abspath = abspath(path)
+                if note_abspath in served_abspaths:
+                    return note_abspath in tagged_abspaths
+            return any(tag_matches(tag) for tag in Note(path).tags)
+
+        return has_matching_tag
+
+
+def _ask_daemon(args, tag_pattern):
+    """
+    Returns absolute paths of the notes a running daemon knows below the
+    queried directories and of those among them with a tag matching
+    ``tag_pattern`` (both as sets, empty if no daemon can tell).
+    """
+    served_abspaths = set()
+    tagged_abspaths = set()
+    # (like ``walk_notes``, which walks by rules the daemon cannot apply)
+    if (not args.daemon or args.max_depth is not None or
+            args.one_file_system):
+        return served_abspaths, tagged_abspaths
+
+    walk_rules = WalkRules.from_args(args).context()
+
+    queries = [args.query] if isinstance(args.query, str) else args.query
+    for query in queries:
+        if not isdir(query):
+            continue
+        dir_abspath = abspath(query)
+        note_abspaths = daemon.find_notes(dir_abspath, args.note_regex,
+                                          walk_rules)
+        if note_abspaths is None:
+            continue
+        tagged_note_abspaths = daemon.find_notes(
+            dir_abspath, args.note_regex, walk_rules, args.tag_regex,
+            tag_pattern)
+        if tagged_note_abspaths is None:
+            continue
+        served_abspaths.update(note_abspaths)
+        tagged_abspaths.update(tagged_note_abspaths)
+    return served_abspaths, tagged_abspaths
@@ -0,0 +1,298 @@
+"""
+Implements a finder that looks up notes by words in their contents
+using a persistent inverted index.
+"""
+
+import logging
+import re
+from json import dumps, loads
+from os import stat, remove, sep as pathsep
+from os.path import abspath, join as path_join
+
+from lib import CACHE_DIR, make_cache_dir
+from lib.cache import stat_signature
+from lib.scanning import ENCODING
+from plugins import Registry, AbstractBaseFinder
+from plugins.file_system import walk_notes
+
+WORD_QUERY_PREFIX = "word:"
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """
+    Splits ``text`` into a list of normalized terms.
+    """
+    return WORD_PATTERN.findall(text.lower())
+
+
+def encode_positions(positions):
+    """
+    Returns ascending ``positions`` as bytes (differences to the previous
+    position as variable-length integers, since these are mostly small).
+    """
+    encoded = bytearray()
+    previous = 0
+    for position in positions:
+        delta = position - previous
+        previous = position
+        while delta >= 0x80:
+            encoded.append(delta & 0x7f | 0x80)
+            delta >>= 7
+        encoded.append(delta)
+    return bytes(encoded)
+
+
+def decode_positions(encoded):
+    """
+    Returns the positions encoded by ``encode_positions``.
+    """
+    positions = []
+    position = delta = shift = 0
+    for byte in encoded:
+        delta |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        position += delta
+        positions.append(position)
+        delta = shift = 0
+    return positions
+
+
+class WordIndex(object):
+    """
+    An inverted index mapping terms to the notes they occur in, including
+    the positions of the terms (to be able to match phrases).
+
+    The index is an SQLite database in ``CACHE_DIR`` keyed by term and
+    note, so a query reads only the postings of its terms and a changed
+    note rewrites only its own rows. It is updated incrementally: only
+    notes whose stat signature changed since they were indexed are read.
+    """
+
+    FILE_NAME = "word_index.sqlite"
+
+    SCHEMA_VERSION = 2
+
+    def __init__(self):
+        # imported on use only, since loading this module is part of every
+        # start (see ``PluginManifest.import_modules``)
+        import sqlite3
+        make_cache_dir()
+        file_name = path_join(CACHE_DIR, self.FILE_NAME)
+        try:
+            self.db = self._connect(file_name)
+        except sqlite3.DatabaseError as exception:
+            logging.info("discarding word index %s: %s", file_name,
+                         exception)
+            remove(file_name)
+            self.db = self._connect(file_name)
+        self.notes = dict(
+            (path, (note_id, loads(signature))) for note_id, path, signature
+            in self.db.execute("SELECT id, path, signature FROM notes"))
+        """ absolute note path -> (id, signature when indexed) """
+
+    @classmethod
+    def _connect(cls, file_name):
+        import sqlite3
+        db = sqlite3.connect(file_name, timeout=30)
+        version, = db.execute("PRAGMA user_version").fetchone()
+        if version != cls.SCHEMA_VERSION:
+            db.executescript("""
+                DROP TABLE IF EXISTS notes;
+                DROP TABLE IF EXISTS postings;
+                DROP TABLE IF EXISTS roots;
+                CREATE TABLE notes (
+                    id INTEGER PRIMARY KEY, path TEXT UNIQUE, signature TEXT);
+                CREATE TABLE postings (
+                    term TEXT, note INTEGER, positions BLOB);
+                CREATE UNIQUE INDEX postings_by_term ON postings (term, note);
+                CREATE INDEX postings_by_note ON postings (note);
+                CREATE TABLE roots (path TEXT PRIMARY KEY);
+                PRAGMA user_version = %u;
+            """ % cls.SCHEMA_VERSION)
+        return db
+
+    def _remove(self, note_abspath):
+        note_id, _ = self.notes.pop(note_abspath)
+        self.db.execute("DELETE FROM postings WHERE note = ?", (note_id,))
+        self.db.execute("DELETE FROM notes WHERE id = ?", (note_id,))
+
+    def _add(self, note_abspath, signature, content):
+        positions = {}
+        for position, term in enumerate(tokenize(content)):
+            positions.setdefault(term, []).append(position)
+        note_id = self.db.execute(
+            "INSERT INTO notes (path, signature) VALUES (?, ?)",
+            (note_abspath, dumps(signature))).lastrowid
+        self.db.executemany(
+            "INSERT INTO postings VALUES (?, ?, ?)",
+            ((term, note_id, encode_positions(term_positions))
+             for term, term_positions in positions.items()))
+        self.notes[note_abspath] = (note_id, signature)
+
+    def roots(self):
+        """
+        Returns the absolute paths of the directories indexed last.
+        """
+        return [path for path, in
+                self.db.execute("SELECT path FROM roots ORDER BY rowid")]
+
+    def set_roots(self, dir_abspaths):
+        """
+        Remembers ``dir_abspaths`` as the directories indexed.
+        """
+        self.db.execute("DELETE FROM roots")
+        self.db.executemany("INSERT OR IGNORE INTO roots VALUES (?)",
+                            ((dir_abspath,) for dir_abspath in dir_abspaths))
+
+    def update(self, note_abspath):
+        """
+        (Re-)indexes the note at ``note_abspath`` if it changed.
+        """
+        try:
+            signature = stat_signature(stat(note_abspath))
+        except OSError:
+            return
+        entry = self.notes.get(note_abspath)
+        if entry is not None:
+            if entry[1] == signature:
+                return
+            self._remove(note_abspath)
+        logging.debug("indexing words of %s", note_abspath)
+        try:
+            with open(note_abspath, encoding=ENCODING,
+                      errors="replace") as note_file:
+                content = note_file.read()
+        except OSError as exception:
+            logging.info("cannot index %s: %s", note_abspath, exception)
+            return
+        self._add(note_abspath, signature, content)
+
+    def remove_missing(self, dir_abspath, existing_abspaths):
+        """
+        Removes all notes below ``dir_abspath`` which are not in
+        ``existing_abspaths`` (i.e. which have been deleted).
+        """
+        prefix = dir_abspath.rstrip(pathsep) + pathsep
+        for note_abspath in list(self.notes):
+            if (note_abspath.startswith(prefix) and
+                    note_abspath not in existing_abspaths):
+                self._remove(note_abspath)
+
+    def _postings(self, term):
+        """
+        Returns ``{absolute note path -> encoded positions of the term}``.
+        """
+        return dict(self.db.execute(
+            "SELECT notes.path, postings.positions FROM postings " +
+            "JOIN notes ON notes.id = postings.note WHERE term = ?", (term,)))
+
+    def lookup(self, words):
+        """
+        Returns absolute paths of notes containing ``words`` as phrase
+        (i.e. in exactly this order).
+        """
+        if not words:
+            return set()
+        postings = [self._postings(word) for word in words]
+        note_abspaths = set(postings[0])
+        for word_postings in postings[1:]:
+            note_abspaths.intersection_update(word_postings)
+
+        if len(words) == 1:
+            return note_abspaths
+
+        # positions are only decoded for notes containing all words
+        matches = set()
+        for note_abspath in note_abspaths:
+            following = [set(decode_positions(p[note_abspath]))
+                         for p in postings[1:]]
+            for position in decode_positions(postings[0][note_abspath]):
+                if all(position + offset in positions
+                       for offset, positions in enumerate(following, 1)):
+                    matches.add(note_abspath)
+                    break
+        return matches
+
+    def save(self):
+        """
+        Persists changes to the index.
+        """
+        self.db.commit()
+
+    def close(self):
+        """
+        Closes the index (discarding changes not saved).
+        """
+        self.db.close()
+
+
+@Registry.register_finder
+class WordIndexFinder(AbstractBaseFinder):
+    """
+    A finder that returns notes containing words specified by queries
+    of the form ``word:<words>``.
+
+    Notes below ``--word-index-dir`` are indexed incrementally on every
+    such query, which requires only to stat unchanged notes.
+    Without ``--word-index-dir``, the directories indexed last are
+    indexed again (instead of e.g. the home directory, if run there).
+    """
+
+    finds = "by words in contents (using 'word:<words>')"
+
+    def set_up(self, arg_parser):
+        arg_parser.add_argument('--word-index-dir', action='append',
+                                help='directory to index notes in for ' +
+                                'word queries (can be given multiple ' +
+                                'times; if not given, the directories ' +
+                                'indexed last or else the current one)')
+
+    def walks(self, args, queries):
+        return any(q.startswith(WORD_QUERY_PREFIX) for q in queries)
+
+    def find(self, args, queries, found_path_callback):
+        """
+        Updates the index and returns all notes matching word queries.
+        """
+        phrases = [tokenize(query[len(WORD_QUERY_PREFIX):])
+                   for query in queries
+                   if query.startswith(WORD_QUERY_PREFIX)]
+        if not phrases:
+            return
+
+        index = WordIndex()
+        walked_paths = {}
+
+        def walked_path_callback(path):
+            """
+            Updates the index for a note found below an indexed directory.
+            """
+            note_abspath = abspath(path)
+            walked_paths[note_abspath] = path
+            index.update(note_abspath)
+
+        try:
+            dir_paths = args.word_index_dir or index.roots() or ["."]
+            index.set_roots(abspath(dir_path) for dir_path in dir_paths)
+            walk_notes(args, dir_paths, walked_path_callback)
+            for dir_path in dir_paths:
+                index.remove_missing(abspath(dir_path), walked_paths)
+            index.save()
+
+            note_abspaths = set()
+            for words in phrases:
+                note_abspaths.update(index.lookup(words))
+        finally:
+            index.close()
+
+        for note_abspath in sorted(note_abspaths):
+            path = walked_paths.get(note_abspath)
+            if path is None:
+                # indexed, but not below the directories currently indexed
+                continue
+            logging.info("found by words in index: %s", path)
+            found_path_callback(path)